@@ -5,4 +5,28 @@ class Config(object):
     # ...
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # In-process cache of live games
+    GAME_CACHE_SIZE = int(os.environ.get('GAME_CACHE_SIZE') or 1000)
+    GAME_CACHE_TTL = float(os.environ.get('GAME_CACHE_TTL') or 60)
+    # Lobby: games per page, seconds games count is cached for
+    LOBBY_PAGE_SIZE = int(os.environ.get('LOBBY_PAGE_SIZE') or 20)
+    LOBBY_COUNT_TTL = float(os.environ.get('LOBBY_COUNT_TTL') or 10)
+    # Max time (seconds) status request is held waiting for game changes
+    LONG_POLL_TIMEOUT = float(os.environ.get('LONG_POLL_TIMEOUT') or 20)
+    # Background generations scheduler: worker threads, seconds between generations
+    SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS') or 4)
+    GENERATION_INTERVAL = float(os.environ.get('GENERATION_INTERVAL') or 0.3)
+    # Seconds game's generations lease lasts unless renewed (only lease holder of all processes moves game)
+    GENERATION_LEASE_TTL = float(os.environ.get('GENERATION_LEASE_TTL') or 30)
+    # Game state snapshot is written every that many state versions (events are logged in between)
+    SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL') or 50)
+    # Simulation worker processes (0 = simulate in scheduler's threads)
+    SIMULATION_PROCESSES = int(os.environ.get('SIMULATION_PROCESSES') or 0)
+    # Seconds simulation worker may take for round, stuck worker is replaced and round is calculated in-process
+    SIMULATION_TIMEOUT = float(os.environ.get('SIMULATION_TIMEOUT') or 60)
+    # Sampling profiler of game's requests and generations (/metrics/profile/<game id>), off by default
+    PROFILING = os.environ.get('PROFILING') == '1'
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS') or 30)
+    # Ids of users allowed to see metrics and run profiler (comma separated), nobody by default
+    OPERATOR_IDS = [int(user_id) for user_id in (os.environ.get('OPERATOR_IDS') or '').split(',') if user_id.strip()]
\ No newline at end of file
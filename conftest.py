@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+""" App is configured when game package is imported, so tests get their own database (and quick generations) before that """
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='gol-test-'), 'test.db')
+os.environ['GENERATION_INTERVAL'] = '0.01'
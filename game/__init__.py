@@ -4,7 +4,11 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+import os
 from os import urandom
+from game.cache import CachedValue, GameCache, UserNameCache
+from game.events import GameEvents
+from game.metrics import Metrics, SamplingProfiler
 
 app = Flask(__name__, instance_relative_config=True)
 
@@ -19,4 +23,26 @@ login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
-from game import routes, models
\ No newline at end of file
+game_cache = GameCache(size=app.config['GAME_CACHE_SIZE'], ttl=app.config['GAME_CACHE_TTL'])
+user_names = UserNameCache()
+""" Number of games listed in lobby """
+lobby_games_count = CachedValue(ttl=app.config['LOBBY_COUNT_TTL'])
+game_events = GameEvents()
+
+metrics = Metrics()
+with app.app_context():
+    metrics.TimeQueries(db.engine, db.session)
+profiler = SamplingProfiler(root=os.path.dirname(app.root_path))
+
+from game.workers import SimulationPool
+simulation_pool = SimulationPool(app.config['SIMULATION_PROCESSES'], app.config['SIMULATION_TIMEOUT']) if app.config['SIMULATION_PROCESSES'] > 0 else None
+
+from game.scheduler import GenerationScheduler
+scheduler = GenerationScheduler(app,
+                                workers=app.config['SCHEDULER_WORKERS'],
+                                interval=app.config['GENERATION_INTERVAL'],
+                                lease_ttl=app.config['GENERATION_LEASE_TTL'],
+                                simulation_pool=simulation_pool)
+
+from game import routes, models
+from game.game import GameOfLife, GameSettings, GameState
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+    Simulation benchmarks module
+    Times game moves, cells adding, state storage round-trips and board rendering
+    on seeded boards of several sizes, players numbers and densities
+    Moves are timed with adaptive engine (move) and with dense one forced (move_dense),
+    so AdaptiveEngine's thresholds can be checked against both
+    Results are written as JSON and compared against stored baseline:
+        python -m game.bench --output results.json --baseline baseline.json
+        python -m game.bench --baseline baseline.json --save-baseline
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+from flask import render_template
+from game import app
+from game.engines import ActivityEngine, AdaptiveEngine
+from game.game import GameOfLife, GameSettings, GameState
+from game.models import Game, GameStateEntry
+from game.store import getGameFromEntry, getStateColumns
+
+SIZES = ((30, 20), (200, 200), (1000, 1000), (2000, 2000))
+PLAYERS = (1, 2, 5)
+DENSITIES = (0.001, 0.05, 0.35)
+""" Boards with more cells aren't rendered (template rendering of such board takes minutes) """
+RENDER_MAX_CELLS = 250000
+""" Generations timed per game (must fit in round) """
+MOVES = 10
+
+
+""" Board of given size with given share of alive cells, owned by random players """
+def seededGrid(width: int, height: int, players: int, density: float, seed: int) -> list:
+    rand = np.random.default_rng([seed, width, height, players, int(density * 1000)])
+    alive = rand.random((height, width)) < density
+    owners = rand.integers(1, players + 1, size=(height, width))
+    return np.where(alive, owners, 0).astype(np.uint8).tolist()
+
+
+""" Game over given board, in given phase, with players moving in id order (adaptive engine by default) """
+def benchGame(grid: list, players: int, phase: int, seed: int, engine=None) -> GameOfLife:
+    settings = GameSettings(generations_per_round=MOVES + 1, rounds_number=30, new_cells_per_round=30)
+    settings.grid_size = (len(grid[0]), len(grid))
+    settings.players_number = players
+    state = GameState()
+    state.SetTrusted(grid=[row[:] for row in grid], phase=phase, players_turn_queue=list(range(1, players + 1)), rng_seed=seed)
+    return GameOfLife(settings=settings, state=state, engine=engine or AdaptiveEngine())
+
+
+""" Seconds per operation: best of several runs, each run returns (seconds taken, operations done) """
+def bestTime(run, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        seconds, operations = run()
+        per_operation = seconds / max(operations, 1)
+        if best is None or per_operation < best:
+            best = per_operation
+    return best
+
+
+def benchMove(grid, players, seed, engine=None):
+    game = benchGame(grid, players, 1, seed, engine)
+    """ First move loads engine, it's not timed """
+    game.Move()
+    start = time.perf_counter()
+    for _ in range(MOVES):
+        game.Move()
+    return time.perf_counter() - start, MOVES
+
+
+def benchMoveDense(grid, players, seed):
+    return benchMove(grid, players, seed, ActivityEngine())
+
+
+def benchAddCell(grid, players, seed):
+    game = benchGame(grid, players, 0, seed)
+    rand = np.random.default_rng(seed)
+    ys, xs = np.nonzero(np.array(grid, dtype=np.uint8) == 0)
+    cells = rand.permutation(len(ys))[:30]
+    start = time.perf_counter()
+    for cell in cells:
+        game.AddCell(int(xs[cell]), int(ys[cell]), 1)
+    return time.perf_counter() - start, len(cells)
+
+
+""" State to JSON and back (as sent to worker processes and clients) """
+def benchJSON(grid, players, seed):
+    state = benchGame(grid, players, 1, seed)._GameOfLife__state
+    start = time.perf_counter()
+    GameState.FromStorage(json.loads(state.ToJSON()))
+    return time.perf_counter() - start, 1
+
+
+""" State to DB entry columns and back to game, as done by store """
+def benchStorage(grid, players, seed):
+    game = benchGame(grid, players, 1, seed)
+    game_entry = Game(settings=game._GameOfLife__settings.ToJSON())
+    start = time.perf_counter()
+    state_entry = GameStateEntry(schema_version=GameStateEntry.SCHEMA_VERSION, **getStateColumns(game._GameOfLife__state))
+    getGameFromEntry(game_entry, state_entry)
+    return time.perf_counter() - start, 1
+
+
+def benchRender(grid, players, seed):
+    with app.test_request_context():
+        start = time.perf_counter()
+        render_template('gameboard.html', grid=grid, gameboard_class='')
+        return time.perf_counter() - start, 1
+
+
+BENCHMARKS = {
+    'move': benchMove,
+    'move_dense': benchMoveDense,
+    'add_cell': benchAddCell,
+    'json': benchJSON,
+    'storage': benchStorage,
+    'render': benchRender,
+}
+
+
+"""
+    Run benchmarks over all combinations of sizes, players numbers and densities
+    Return result name => seconds per operation
+"""
+def runBenchmarks(sizes=SIZES, players_numbers=PLAYERS, densities=DENSITIES, names=None,
+                  repeat: int=3, seed: int=0, log=None) -> dict:
+    results = {}
+    for width, height in sizes:
+        for players in players_numbers:
+            for density in densities:
+                grid = seededGrid(width, height, players, density, seed)
+                for name in names or BENCHMARKS:
+                    if name == 'render' and width * height > RENDER_MAX_CELLS:
+                        continue
+                    key = '{}/{}x{}/p{}/d{}'.format(name, width, height, players, density)
+                    results[key] = bestTime(lambda: BENCHMARKS[name](grid, players, seed), repeat)
+                    if log is not None:
+                        log('{:<40} {:>12.6f}s'.format(key, results[key]))
+    return results
+
+
+""" Results slower than baseline by more than threshold share: name => (baseline seconds, seconds) """
+def compareResults(results: dict, baseline: dict, threshold: float=0.2) -> dict:
+    regressions = {}
+    for name, seconds in results.items():
+        baseline_seconds = baseline.get(name)
+        if baseline_seconds is not None and seconds > baseline_seconds * (1 + threshold):
+            regressions[name] = (baseline_seconds, seconds)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m game.bench', description='Game simulation benchmarks')
+    parser.add_argument('--sizes', default=','.join('{}x{}'.format(*size) for size in SIZES),
+                        help='comma separated grid sizes, WIDTHxHEIGHT')
+    parser.add_argument('--players', default=','.join(map(str, PLAYERS)), help='comma separated players numbers')
+    parser.add_argument('--densities', default=','.join(map(str, DENSITIES)), help='comma separated shares of alive cells')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, best one counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write results to (JSON)')
+    parser.add_argument('--baseline', help='baseline results file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write results to baseline file instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown share before result counts as regression')
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(side) for side in size.split('x')) for size in args.sizes.split(',')]
+    names = args.only.split(',')
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(name))
+    results = runBenchmarks(sizes, [int(players) for players in args.players.split(',')],
+                            [float(density) for density in args.densities.split(',')],
+                            names, args.repeat, args.seed, log=print)
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compareResults(results, baseline, args.threshold)
+        for name, (baseline_seconds, seconds) in sorted(regressions.items()):
+            print('REGRESSION {:<40} {:.6f}s -> {:.6f}s (+{:.0%})'.format(name, baseline_seconds, seconds,
+                                                                           seconds / baseline_seconds - 1))
+        if regressions:
+            return 1
+        print('No regressions against baseline (threshold {:.0%})'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
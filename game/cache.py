@@ -0,0 +1,179 @@
+""" In-process games cache module """
+import threading
+import time
+from collections import OrderedDict, deque
+from game.game import GameOfLife
+from game.grid import gridChanges
+
+
+"""
+    Changed cells of recent versions of game's grid,
+    so clients can be sent only changes since version they have
+"""
+class GridHistory:
+    __slots__ = ('__grid', '__changes')
+
+    def __init__(self, grid: list, size: int=64):
+        self.__grid = [list(row) for row in grid]
+        """ (version, cells changed since previous version) """
+        self.__changes = deque(maxlen=size)
+
+    """ Remember grid of new version """
+    def Record(self, version: int, grid: list):
+        if self.__changes and self.__changes[-1][0] == version:
+            return
+        self.__changes.append((version, gridChanges(self.__grid, grid)))
+        self.__grid = [list(row) for row in grid]
+
+    """ Remember frames of several versions at once (see GameOfLife.SimulateRound) and grid of last one """
+    def RecordFrames(self, frames: list, grid: list):
+        for version, changes in frames:
+            if not self.__changes or self.__changes[-1][0] < version:
+                self.__changes.append((version, changes))
+        self.__grid = [list(row) for row in grid]
+
+    """ Cells changed after given version ([x, y, cell] lists), None if history is too short """
+    def ChangesSince(self, version: int) -> list:
+        if not self.__hasVersion(version):
+            return None
+        cells = {}
+        for changes_version, changes in self.__changes:
+            if changes_version > version:
+                for x, y, cell in changes:
+                    cells[(x, y)] = cell
+        return [[x, y, cell] for (x, y), cell in cells.items()]
+
+    """ Changes of every version after given one ([version, changes] lists), None if history is too short """
+    def FramesSince(self, version: int) -> list:
+        if not self.__hasVersion(version):
+            return None
+        return [[changes_version, changes] for changes_version, changes in self.__changes if changes_version > version]
+
+    def __hasVersion(self, version):
+        return bool(self.__changes) and self.__changes[0][0] <= version + 1 <= self.__changes[-1][0]
+
+
+""" Live game with data of its DB entry needed on every request """
+class CachedGame:
+    __slots__ = ('id', 'game', 'first_player_id', 'second_player_id', 'status',
+                 'loaded_at', 'lock', 'history', 'stored_state', 'snapshot_version',
+                 'stored_version')
+
+    def __init__(self, id: int, game: GameOfLife, first_player_id: int, second_player_id: int, status: int):
+        self.id = id
+        self.game = game
+        self.first_player_id = first_player_id
+        self.second_player_id = second_player_id
+        self.status = status
+        self.loaded_at = time.monotonic()
+        """ Held while game is being changed """
+        self.lock = threading.RLock()
+        self.history = GridHistory(game.Grid)
+        """ State snapshot columns as they're in DB, so only changed ones are written """
+        self.stored_state = {}
+        self.snapshot_version = game.Version
+        """ Game's version column as it's in DB, game is only written if nobody changed it since """
+        self.stored_version = 0
+
+
+"""
+    Bounded cache of live games, keyed by game id
+    Least recently used entries are evicted when cache is full,
+    entries older than TTL are reloaded (cache is per-process,
+    so TTL bounds staleness if several processes serve same game)
+"""
+class GameCache:
+    __slots__ = ('__size', '__ttl', '__entries', '__lock')
+
+    def __init__(self, size: int=1000, ttl: float=60.0):
+        self.__size = size
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def Get(self, game_id: int) -> CachedGame:
+        with self.__lock:
+            entry = self.__entries.get(game_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.__ttl:
+                del self.__entries[game_id]
+                return None
+            self.__entries.move_to_end(game_id)
+            return entry
+
+    def Put(self, entry: CachedGame) -> CachedGame:
+        with self.__lock:
+            self.__entries[entry.id] = entry
+            self.__entries.move_to_end(entry.id)
+            while len(self.__entries) > self.__size:
+                self.__entries.popitem(last=False)
+            return entry
+
+    """ Mark entry as changed (after its changes are written to DB) """
+    def Touch(self, entry: CachedGame):
+        with self.__lock:
+            entry.loaded_at = time.monotonic()
+            entry.history.Record(entry.game.Version, entry.game.Grid)
+
+    def Invalidate(self, game_id: int):
+        with self.__lock:
+            self.__entries.pop(game_id, None)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+""" Single value loaded on demand and kept for TTL (e.g. count that's expensive to query) """
+class CachedValue:
+    __slots__ = ('__ttl', '__value', '__loaded_at', '__lock')
+
+    def __init__(self, ttl: float=10.0):
+        self.__ttl = ttl
+        self.__value = None
+        self.__loaded_at = None
+        self.__lock = threading.Lock()
+
+    """ Cached value, loaded with given function if there's none or it's too old """
+    def Get(self, load):
+        with self.__lock:
+            if self.__loaded_at is not None and time.monotonic() - self.__loaded_at <= self.__ttl:
+                return self.__value
+        value = load()
+        with self.__lock:
+            self.__value = value
+            self.__loaded_at = time.monotonic()
+        return value
+
+    def Invalidate(self):
+        with self.__lock:
+            self.__loaded_at = None
+
+
+""" Bounded cache of users' names by user id (least recently used ones are evicted) """
+class UserNameCache:
+    __slots__ = ('__size', '__names', '__lock')
+
+    def __init__(self, size: int=10000):
+        self.__size = size
+        self.__names = OrderedDict()
+        self.__lock = threading.Lock()
+
+    """ User's name, None if it's not cached """
+    def Get(self, user_id: int) -> str:
+        with self.__lock:
+            name = self.__names.get(user_id)
+            if name is not None:
+                self.__names.move_to_end(user_id)
+            return name
+
+    def Put(self, user_id: int, name: str):
+        with self.__lock:
+            self.__names[user_id] = name
+            self.__names.move_to_end(user_id)
+            while len(self.__names) > self.__size:
+                self.__names.popitem(last=False)
+
+    def Invalidate(self, user_id: int):
+        with self.__lock:
+            self.__names.pop(user_id, None)
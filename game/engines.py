@@ -0,0 +1,467 @@
+""" Generation engines module """
+import abc
+import numpy as np
+
+
+"""
+    Common engine interface
+    Engine keeps its own representation of the grid between generations,
+    so it is loaded once and then only notified about added cells
+"""
+class Engine(abc.ABC):
+    __slots__ = ()
+
+    """ Load grid (list of rows of player ids) into engine """
+    @abc.abstractmethod
+    def Load(self, grid: list):
+        pass
+
+    """ Put player's alive cell into (x, y) """
+    @abc.abstractmethod
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        pass
+
+    """ Step player's cells to next generation """
+    @abc.abstractmethod
+    def PlayerMove(self, player: int):
+        pass
+
+    """ Export grid as list of rows of player ids """
+    @abc.abstractmethod
+    def Grid(self) -> list:
+        pass
+
+    """ Number of alive cells of all players """
+    @abc.abstractmethod
+    def Population(self) -> int:
+        pass
+
+    """ Cells changed by last generation ([x, y, cell] lists), None if engine doesn't track them """
+    def Changes(self) -> list:
+        return None
+
+    """ Bytes identifying board: same for equal boards of engine (without exporting grid, if engine can help it) """
+    def Fingerprint(self) -> bytes:
+        return bytes(cell for row in self.Grid() for cell in row)
+
+    """ Number of alive cells of every player (player id => count) """
+    def Counts(self) -> dict:
+        counts = {}
+        for row in self.Grid():
+            for cell in row:
+                if cell != 0:
+                    counts[cell] = counts.get(cell, 0) + 1
+        return counts
+
+    """ Step to next generation: each player moves in turn order """
+    def Generation(self, players: list):
+        for player in players:
+            self.PlayerMove(player)
+
+    """ Step several generations forward """
+    def Advance(self, players: list, generations: int):
+        for _ in range(generations):
+            self.Generation(players)
+
+
+"""
+    Dense engine, grid is kept as NumPy uint8 array
+    Cells of every value are counted on load and then kept up to date with births and deaths
+"""
+class NumpyEngine(Engine):
+    __slots__ = ('__grid', '__counts')
+
+    def __init__(self):
+        self.__grid = np.zeros((0, 0), dtype=np.uint8)
+        self.__counts = np.zeros(256, dtype=np.int64)
+
+    def Load(self, grid: list):
+        self.__grid = np.array(grid, dtype=np.uint8).reshape(len(grid), len(grid[0]) if grid else 0)
+        self.__counts = np.bincount(self.__grid.ravel(), minlength=256).astype(np.int64)
+
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        self.__counts[self.__grid[cell_y, cell_x]] -= 1
+        self.__counts[player] += 1
+        self.__grid[cell_y, cell_x] = player
+
+    def PlayerMove(self, player: int):
+        alive = self.__grid == player
+        neighbors = self.NeighborsCount(alive)
+        """ Same rules as GameOfLife.__getCellNewStatus """
+        dead = alive & ((neighbors < 2) | (neighbors > 3))
+        born = ~alive & (neighbors == 3)
+        born_over = np.bincount(self.__grid[born], minlength=256)
+        self.__grid[dead] = 0
+        self.__grid[born] = player
+        dead_number = int(np.count_nonzero(dead))
+        self.__counts -= born_over
+        self.__counts[player] += int(born_over.sum()) - dead_number
+        self.__counts[0] += dead_number
+
+    def Grid(self) -> list:
+        return self.__grid.tolist()
+
+    def Population(self) -> int:
+        return int(np.count_nonzero(self.__grid))
+
+    def Fingerprint(self) -> bytes:
+        return self.__grid.tobytes()
+
+    def Counts(self) -> dict:
+        return {player: int(count) for player, count in enumerate(self.__counts) if player != 0 and count != 0}
+
+    """ Count alive neighbors of every cell, grid is wrapped as torus """
+    @staticmethod
+    def NeighborsCount(alive: np.ndarray) -> np.ndarray:
+        alive = alive.astype(np.uint8)
+        rows = alive + np.roll(alive, 1, axis=0) + np.roll(alive, -1, axis=0)
+        return rows + np.roll(rows, 1, axis=1) + np.roll(rows, -1, axis=1) - alive
+
+
+"""
+    Sparse engine, keeps sets of alive cells' coordinates per player
+    Only alive cells and their neighbors are evaluated, so generation cost
+    depends on population rather than grid size
+"""
+class SparseEngine(Engine):
+    __slots__ = ('__width', '__height', '__cells', '__players_cells', '__changed_from')
+
+    NEIGHBORS_OFFSETS = tuple((dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx != 0 or dy != 0)
+
+    def __init__(self):
+        self.__width = 0
+        self.__height = 0
+        self.__cells = {}
+        self.__players_cells = {}
+        """ Changed cell => its value before last generation """
+        self.__changed_from = {}
+
+    def Load(self, grid: list):
+        self.__height = len(grid)
+        self.__width = len(grid[0]) if grid else 0
+        self.__cells = {}
+        self.__players_cells = {}
+        self.__changed_from = {}
+        for y, row in enumerate(grid):
+            for x, cell in enumerate(row):
+                if cell != 0:
+                    self.SetCell(x, y, cell)
+
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        cell = (cell_x, cell_y)
+        old_player = self.__cells.pop(cell, 0)
+        self.__changed_from.setdefault(cell, old_player)
+        if old_player != 0:
+            self.__players_cells[old_player].discard(cell)
+        if player != 0:
+            self.__cells[cell] = player
+            self.__players_cells.setdefault(player, set()).add(cell)
+
+    def PlayerMove(self, player: int):
+        alive = self.__players_cells.get(player)
+        if not alive:
+            return
+        
+        """ Count ACCP neighbors of every cell near alive ones, grid is wrapped as torus """
+        neighbors = {}
+        width, height = self.__width, self.__height
+        for cell_x, cell_y in alive:
+            for dx, dy in self.NEIGHBORS_OFFSETS:
+                cell = ((cell_x + dx) % width, (cell_y + dy) % height)
+                neighbors[cell] = neighbors.get(cell, 0) + 1
+        
+        """ Same rules as GameOfLife.__getCellNewStatus """
+        dead = [cell for cell in alive if not 2 <= neighbors.get(cell, 0) <= 3]
+        born = [cell for cell, count in neighbors.items() if count == 3 and cell not in alive]
+        for cell in dead:
+            self.SetCell(cell[0], cell[1], 0)
+        for cell in born:
+            self.SetCell(cell[0], cell[1], player)
+
+    def Generation(self, players: list):
+        self.__changed_from = {}
+        super().Generation(players)
+
+    def Grid(self) -> list:
+        grid = [[0] * self.__width for _ in range(self.__height)]
+        for (x, y), player in self.__cells.items():
+            grid[y][x] = player
+        return grid
+
+    def Changes(self) -> list:
+        changes = []
+        for (x, y), old_player in self.__changed_from.items():
+            player = self.__cells.get((x, y), 0)
+            if player != old_player:
+                changes.append([x, y, player])
+        return changes
+
+    def Population(self) -> int:
+        return len(self.__cells)
+
+    def Fingerprint(self) -> bytes:
+        return repr(sorted(self.__cells.items())).encode()
+
+    def Counts(self) -> dict:
+        return {player: len(cells) for player, cells in self.__players_cells.items() if cells}
+
+
+"""
+    Dense engine that only evaluates regions where something can change
+    Grid is split into tiles, and every player has set of dirty tiles: ones with
+    player's cells changed (or near such cells) since player's last move, as only
+    they can change on player's next move; tiles are marked across torus edges
+    Most of board being dirty, whole grid is stepped at once (like NumpyEngine)
+"""
+class ActivityEngine(Engine):
+    __slots__ = ('__grid', '__counts', '__tile_size', '__full_step_share', '__dirty', '__changes', '__hash')
+
+    """ Constants of splitmix64 finalizer, used to hash (cell, player) pairs """
+    HASH_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+    HASH_MULTIPLIERS = (np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb))
+
+    def __init__(self, tile_size: int=8, full_step_share: float=0.25):
+        self.__grid = np.zeros((0, 0), dtype=np.uint8)
+        self.__counts = np.zeros(256, dtype=np.int64)
+        self.__tile_size = tile_size
+        self.__full_step_share = full_step_share
+        """ player => bool array of player's dirty tiles """
+        self.__dirty = {}
+        """ (cells, their players before change) of every player's move of last generation, cells are flat indices """
+        self.__changes = []
+        """ Sum of hashes of board's alive (cell, player) pairs, so changed cells are enough to update it """
+        self.__hash = 0
+
+    def Load(self, grid: list):
+        self.__grid = np.array(grid, dtype=np.uint8).reshape(len(grid), len(grid[0]) if grid else 0)
+        self.__counts = np.bincount(self.__grid.ravel(), minlength=256).astype(np.int64)
+        self.__dirty = {int(player): np.ones(self.__tilesShape(), dtype=bool) for player in np.unique(self.__grid) if player != 0}
+        self.__changes = []
+        self.__hash = self.__cellsHash(np.arange(self.__grid.size), self.__grid.ravel())
+
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        old_player = int(self.__grid[cell_y, cell_x])
+        if old_player == player:
+            return
+        self.__counts[old_player] -= 1
+        self.__counts[player] += 1
+        self.__grid[cell_y, cell_x] = player
+        cell = np.array([cell_y * self.__grid.shape[1] + cell_x])
+        self.__hash = (self.__hash + self.__cellsHash(cell, np.array([player], dtype=np.uint8))
+                       - self.__cellsHash(cell, np.array([old_player], dtype=np.uint8))) % 2 ** 64
+        tiles = self.__cellsTiles(cell_y, cell_x)
+        for changed_player in (old_player, player):
+            self.__markDirty(changed_player, tiles)
+
+    def PlayerMove(self, player: int):
+        dirty = self.__dirty.get(player)
+        if dirty is None or not dirty.any():
+            return
+        self.__dirty[player] = np.zeros_like(dirty)
+        
+        """ Same rules as GameOfLife.__getCellNewStatus, dead and born cells are flat indices """
+        grid = self.__grid
+        height, width = grid.shape
+        cells_grid = grid.ravel()
+        if dirty.mean() > self.__full_step_share:
+            alive = grid == player
+            neighbors = NumpyEngine.NeighborsCount(alive)
+            is_dead = alive & ((neighbors < 2) | (neighbors > 3))
+            is_born = ~alive & (neighbors == 3)
+            dead = np.flatnonzero(is_dead)
+            born = np.flatnonzero(is_born)
+            changed_tiles = self.__maskTiles(is_dead | is_born)
+        else:
+            ys, xs = self.__tilesCells(dirty)
+            """ Only dirty tiles' cells and their neighbors are read, coordinates wrap around torus edges """
+            alive = cells_grid.take(ys * width + xs) == player
+            neighbors = np.zeros(len(ys), dtype=np.uint8)
+            for dx, dy in SparseEngine.NEIGHBORS_OFFSETS:
+                neighbors += cells_grid.take((ys + dy) % height * width + (xs + dx) % width) == player
+            is_dead = alive & ((neighbors < 2) | (neighbors > 3))
+            is_born = ~alive & (neighbors == 3)
+            dead = ys[is_dead] * width + xs[is_dead]
+            born = ys[is_born] * width + xs[is_born]
+            changed = np.concatenate((dead, born))
+            changed_tiles = self.__cellsTiles(changed // width, changed % width)
+        owners = cells_grid[born]
+        taken_tiles = {owner: self.__cellsTiles(*np.divmod(born[owners == owner], width)) for owner in self.__owners(owners)}
+        
+        dead_players = np.full(len(dead), player, dtype=np.uint8)
+        born_players = np.full(len(born), player, dtype=np.uint8)
+        self.__changes.append((np.concatenate((dead, born)), np.concatenate((dead_players, owners))))
+        self.__hash = (self.__hash + self.__cellsHash(born, born_players)
+                       - self.__cellsHash(dead, dead_players) - self.__cellsHash(born, owners)) % 2 ** 64
+        cells_grid[dead] = 0
+        cells_grid[born] = player
+        self.__counts -= np.bincount(owners, minlength=256)
+        self.__counts[player] += len(owners) - len(dead)
+        self.__counts[0] += len(dead)
+        
+        self.__markDirty(player, changed_tiles)
+        """ Cells taken from other players change their neighborhoods too """
+        for owner, tiles in taken_tiles.items():
+            self.__markDirty(owner, tiles)
+
+    def Generation(self, players: list):
+        self.__changes = []
+        super().Generation(players)
+
+    def Grid(self) -> list:
+        return self.__grid.tolist()
+
+    """ Cells changed by players' moves, except ones that came back to where they were at generation's start """
+    def Changes(self) -> list:
+        if not self.__changes:
+            return []
+        cells, old_players = (np.concatenate(parts) for parts in zip(*self.__changes))
+        cells, first = np.unique(cells, return_index=True)
+        players = self.__grid.ravel()[cells]
+        is_changed = players != old_players[first]
+        ys, xs = np.divmod(cells[is_changed], self.__grid.shape[1])
+        return np.stack((xs, ys, players[is_changed]), axis=1).tolist()
+
+    def Population(self) -> int:
+        return int(self.__grid.size - self.__counts[0])
+
+    def Fingerprint(self) -> bytes:
+        return self.__hash.to_bytes(8, 'little')
+
+    def Counts(self) -> dict:
+        return {player: int(count) for player, count in enumerate(self.__counts) if player != 0 and count != 0}
+
+    """ Sum of hashes of (cell, player) pairs (mod 2 ** 64), empty cells add nothing """
+    @classmethod
+    def __cellsHash(cls, cells, players):
+        alive = players != 0
+        values = cells[alive].astype(np.uint64) * np.uint64(256) + players[alive]
+        for shift, multiplier in zip(cls.HASH_SHIFTS, cls.HASH_MULTIPLIERS):
+            values = (values ^ (values >> shift)) * multiplier
+        values ^= values >> cls.HASH_SHIFTS[-1]
+        return int(values.sum(dtype=np.uint64))
+
+    """ Mark changed tiles and tiles next to them (wrapped as torus) as dirty for player """
+    def __markDirty(self, player, tiles):
+        if player == 0:
+            return
+        dirty = self.__dirty.get(player)
+        if dirty is None:
+            dirty = self.__dirty[player] = np.zeros(self.__tilesShape(), dtype=bool)
+        rows = tiles.copy()
+        rows[1:] |= tiles[:-1]
+        rows[:-1] |= tiles[1:]
+        rows[0] |= tiles[-1]
+        rows[-1] |= tiles[0]
+        dirty |= rows
+        dirty[:, 1:] |= rows[:, :-1]
+        dirty[:, :-1] |= rows[:, 1:]
+        dirty[:, 0] |= rows[:, -1]
+        dirty[:, -1] |= rows[:, 0]
+
+    def __tilesShape(self):
+        return tuple(-(-size // self.__tile_size) for size in self.__grid.shape)
+
+    """ Tiles containing given cells """
+    def __cellsTiles(self, ys, xs):
+        tiles = np.zeros(self.__tilesShape(), dtype=bool)
+        tiles[np.asarray(ys) // self.__tile_size, np.asarray(xs) // self.__tile_size] = True
+        return tiles
+
+    """ Tiles containing any cell set in mask of grid's shape """
+    def __maskTiles(self, mask):
+        tiles_height, tiles_width = self.__tilesShape()
+        padded = np.zeros((tiles_height * self.__tile_size, tiles_width * self.__tile_size), dtype=bool)
+        padded[:mask.shape[0], :mask.shape[1]] = mask
+        rows = padded.reshape(tiles_height, self.__tile_size, -1).any(axis=1)
+        return rows.reshape(tiles_height, tiles_width, self.__tile_size).any(axis=2)
+
+    """ Other players whose cells were taken """
+    @staticmethod
+    def __owners(owners):
+        return [int(owner) for owner in np.unique(owners) if owner != 0]
+
+    """ Coordinates (ys, xs) of all cells of given tiles """
+    def __tilesCells(self, tiles):
+        tile_ys, tile_xs = np.nonzero(tiles)
+        offset_ys, offset_xs = np.divmod(np.arange(self.__tile_size ** 2), self.__tile_size)
+        ys = (tile_ys[:, None] * self.__tile_size + offset_ys).ravel()
+        xs = (tile_xs[:, None] * self.__tile_size + offset_xs).ravel()
+        inside = (ys < self.__grid.shape[0]) & (xs < self.__grid.shape[1])
+        return ys[inside], xs[inside]
+
+
+"""
+    Engine that picks sparse or dense engine based on board's population
+    Switches between them (with some hysteresis) as population changes
+"""
+class AdaptiveEngine(Engine):
+    __slots__ = ('__dense', '__sparse', '__current', '__stepped', '__cells_number')
+
+    """
+        Boards with less alive cells than SPARSE_CELLS plus SPARSE_DENSITY share of board use sparse engine
+        Calibrated with game.bench (move vs move_dense): sparse generation costs 3-6us per alive cell,
+        dense one ~0.25ms plus ~8ns per board cell, so sparse only pays off on nearly empty boards
+    """
+    SPARSE_CELLS = 50
+    SPARSE_DENSITY = 0.001
+
+    def __init__(self):
+        self.__dense = ActivityEngine()
+        self.__sparse = SparseEngine()
+        self.__current = self.__sparse
+        """ Engine last generation was calculated with (current one may have been switched since) """
+        self.__stepped = self.__current
+        self.__cells_number = 0
+
+    def Load(self, grid: list):
+        self.__cells_number = len(grid) * (len(grid[0]) if grid else 0)
+        population = sum(1 for row in grid for cell in row if cell != 0)
+        if population < self.__sparseLimit():
+            self.__current = self.__sparse
+        else:
+            self.__current = self.__dense
+        self.__current.Load(grid)
+        self.__stepped = self.__current
+
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        self.__current.SetCell(cell_x, cell_y, player)
+
+    def PlayerMove(self, player: int):
+        self.__current.PlayerMove(player)
+
+    def Generation(self, players: list):
+        self.__current.Generation(players)
+        self.__stepped = self.__current
+        self.__switchIfNeeded()
+
+    def Grid(self) -> list:
+        return self.__current.Grid()
+
+    def Changes(self) -> list:
+        return self.__stepped.Changes()
+
+    def Population(self) -> int:
+        return self.__current.Population()
+
+    def Fingerprint(self) -> bytes:
+        return self.__current.Fingerprint()
+
+    def Counts(self) -> dict:
+        return self.__current.Counts()
+
+    @property
+    def Current(self) -> Engine:
+        return self.__current
+
+    """ Population under which sparse engine is faster """
+    def __sparseLimit(self) -> float:
+        return self.SPARSE_CELLS + self.SPARSE_DENSITY * self.__cells_number
+
+    def __switchIfNeeded(self):
+        population = self.__current.Population()
+        if self.__current is self.__sparse and population > 2 * self.__sparseLimit():
+            self.__dense.Load(self.__sparse.Grid())
+            self.__current = self.__dense
+        elif self.__current is self.__dense and population < self.__sparseLimit() / 2:
+            self.__sparse.Load(self.__dense.Grid())
+            self.__current = self.__sparse
@@ -0,0 +1,39 @@
+""" Game change notifications module """
+import threading
+
+
+"""
+    Notifications about games' changes, used for long-polling:
+    request waits until game changes (or timeout passes)
+    Notifications are per-process, so waiting must always be limited by timeout
+"""
+class GameEvents:
+    __slots__ = ('__conditions', '__lock')
+
+    def __init__(self):
+        """ game id => [condition, number of requests waiting on it], entry is removed once nobody waits """
+        self.__conditions = {}
+        self.__lock = threading.Lock()
+
+    """ Game changed, wake up everyone waiting for it """
+    def Notify(self, game_id: int):
+        with self.__lock:
+            entry = self.__conditions.get(game_id)
+        if entry is None:
+            return
+        with entry[0]:
+            entry[0].notify_all()
+
+    """ Wait until predicate is true, return predicate's last result """
+    def Wait(self, game_id: int, predicate, timeout: float) -> bool:
+        with self.__lock:
+            entry = self.__conditions.setdefault(game_id, [threading.Condition(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                return entry[0].wait_for(predicate, timeout)
+        finally:
+            with self.__lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.__conditions[game_id]
@@ -4,15 +4,20 @@ import json
 import logging
 import random
 import time
+from game.engines import AdaptiveEngine, Engine, SparseEngine
+from game.grid import PackedGrid, gridChanges
 
 
 """ Common JSONable functionality """
 class JSONable(abc.ABC):
-    def ToJSON(self):
+    def ToDict(self):
         obj_dict = {}
         for param in self.__slots__:
             obj_dict[param] = self.__getattribute__(param)
-        return json.dumps(obj_dict)
+        return obj_dict
+    
+    def ToJSON(self):
+        return json.dumps(self.ToDict())
 
 
 """ Game settings """
@@ -74,7 +79,8 @@ class GameSettings(JSONable):
 """ Game state """
 class GameState(JSONable):
     __slots__ = ('grid', 'phase', 'players_turn_queue', 'cur_player_index',
-                'cur_round', 'cur_round_generation', 'cur_winner', 'cur_player_added_cells')
+                'cur_round', 'cur_round_generation', 'cur_winner', 'cur_player_added_cells',
+                'version', 'counts', 'rng_seed', 'cycle_period', 'cycle_version')
 
     def __init__(self):
         self.grid = []
@@ -85,36 +91,87 @@ class GameState(JSONable):
         self.cur_round_generation = 1
         self.cur_winner = []
         self.cur_player_added_cells = 0
+        self.version = 0 # increased on every change
+        self.counts = [] # players' alive cells numbers, by player id (empty = not counted yet)
+        self.rng_seed = 0 # seed of game's random choices
+        self.cycle_period = 0 # period of cycle last simulated round's board settled into (0 = none)
+        self.cycle_version = 0 # version cycle was found at
+    
+    """ Int params' (min, max) values, None = not limited """
+    __INT_RANGES = {
+        'phase': (-1, 1),
+        'cur_player_index': (0, None),
+        'cur_player_added_cells': (0, None),
+        'version': (0, None),
+        'rng_seed': (0, None),
+        'cycle_period': (0, None),
+        'cycle_version': (0, None),
+        'cur_round': (1, None),
+        'cur_round_generation': (1, None),
+    }
     
     """ Overwrite setter for validation """
     def __setattr__(self, name, val):
-        if not name in self.__slots__:
-            return
-        
-        if name == 'grid':
-            is_valid = self.__validateGrid(val)
-        elif name == 'players_turn_queue':
-            is_valid = self.__validatePlayersTurnQueue(val)
-        elif name == 'cur_winner':
-            is_valid = self.__validateCurWinner(val)
-        else:
-            """ All other params must be int in some range """
+        int_range = self.__INT_RANGES.get(name)
+        if int_range is not None:
             try:
                 val = int(val)
             except:
                 return
-            if name == 'phase':
-                is_valid = -1 <= val <= 1
-            elif name == 'cur_player_index' or name == 'cur_player_added_cells':
-                is_valid = val >= 0
-            elif name == 'cur_round' or name == 'cur_round_generation':
-                is_valid = val > 0
-            else:
-                is_valid = False
+            is_valid = int_range[0] <= val and (int_range[1] is None or val <= int_range[1])
+        elif name == 'grid':
+            if isinstance(val, str):
+                val = self.__unpackGrid(val)
+            is_valid = self.__validateGrid(val)
+        elif name == 'players_turn_queue':
+            is_valid = self.__validatePlayersTurnQueue(val)
+        elif name == 'cur_winner' or name == 'counts':
+            is_valid = self.__validateNonNegativeInts(val)
+        else:
+            return
         
         if is_valid:
             super().__setattr__(name, val)
     
+    """
+        Make state from stored params (parsed JSON)
+        Params written by server itself are trusted and set without validation,
+        any other input must be validated
+    """
+    @classmethod
+    def FromStorage(cls, params: dict, trusted: bool=True) -> 'GameState':
+        state = cls()
+        if not trusted:
+            for param in params:
+                state.__setattr__(param, params[param])
+            return state
+        
+        for param in cls.__slots__:
+            if param in params:
+                val = params[param]
+                if param == 'grid' and isinstance(val, str):
+                    val = PackedGrid.FromBase64(val).ToRows()
+                object.__setattr__(state, param, val)
+        return state
+    
+    """ Set params calculated by game itself, without validation """
+    def SetTrusted(self, **params):
+        for param in params:
+            object.__setattr__(self, param, params[param])
+    
+    """ Grid is stored packed, see PackedGrid """
+    def ToJSON(self):
+        obj_dict = self.ToDict()
+        obj_dict['grid'] = PackedGrid.FromRows(self.grid).ToBase64()
+        return json.dumps(obj_dict)
+    
+    """ Get grid rows from packed grid string, None if it can't be unpacked """
+    def __unpackGrid(self, packed_grid):
+        try:
+            return PackedGrid.FromBase64(packed_grid).ToRows()
+        except:
+            return None
+    
     """ Grid must be a matrix of ints >= 0 """
     def __validateGrid(self, grid):
         if not isinstance(grid, list):
@@ -148,12 +205,12 @@ class GameState(JSONable):
         
         return True
     
-    """ Current winner must be a list (empty or of ints >= 0) """
-    def __validateCurWinner(self, winner):
-        if not isinstance(winner, list):
+    """ Current winner and counts must be lists (empty or of ints >= 0) """
+    def __validateNonNegativeInts(self, values):
+        if not isinstance(values, list):
             return False
         
-        for p in winner:
+        for p in values:
             try:
                 p = int(p)
                 if p < 0:
@@ -166,11 +223,14 @@ class GameState(JSONable):
 
 """ Game logic """
 class GameOfLife:
-    __slots__ = ('__settings', '__state', 'error_message', 'counts')
+    __slots__ = ('__settings', '__state', '__engine', '__engine_grid', '__events', 'error_message')
 
+    """ New game's random choices are made with given seed (random one if not set) """
     def __init__(self,
                 settings: GameSettings=None,
-                state: GameState=None):
+                state: GameState=None,
+                engine: Engine=None,
+                seed: int=None):
         if isinstance(settings, GameSettings):
             self.__settings = settings
         else :
@@ -180,11 +240,17 @@ class GameOfLife:
             self.__state = state
         else:
             self.__state = GameState()
+            self.__state.rng_seed = random.getrandbits(32) if seed is None else seed
             self.__resetGrid()
             self.__setPlayersQueue()
         
+        """ No engine = built-in per-cell calculation """
+        self.__engine = engine
+        self.__engine_grid = None
+        """ Events not yet taken by storage: (kind, state version after event, data) """
+        self.__events = []
         self.error_message = ''
-        self.__setCounts()
+        self.__setCountsIfNeeded()
     
     """ Game move logic """
     def Move(self) -> bool:
@@ -194,27 +260,146 @@ class GameOfLife:
             return False
         
         """ Each player's cells step to next generation """
-        self.__state.cur_player_index = 0
-        while self.__state.cur_player_index < len(self.__state.players_turn_queue):
-            self.__playerMove()
-            self.__state.cur_player_index += 1
-        self.__state.cur_round_generation += 1
-        self.__setWinner()
-
-        """ Round generations ended - move to next round """
-        if self.__state.cur_round_generation > self.__settings.generations_per_round:
-            self.__state.cur_round += 1
-            self.__state.cur_round_generation = 1
-            if self.IsOver:
-                self.__state.phase = -1
-                return True
-            self.__state.phase = 0
-            random.shuffle(self.__state.players_turn_queue)
-            self.__state.cur_player_index = 0
-            self.__state.cur_player_added_cells = 0
+        if self.__engine is None:
+            self.__generationMove()
+            self.__state.cur_player_index = len(self.__state.players_turn_queue)
+        else:
+            self.__syncEngine()
+            self.__engineMove()
+            self.__exportEngineGrid()
+        self.__finishMove(1)
+        return True
+    
+    """ Move several generations at once (but not past current round's end) """
+    def Advance(self, generations: int) -> bool:
+        if self.__state.phase != 1:
+            self.error_message = 'Add cells first, you must'
+            return False
+        
+        generations = min(generations, self.__settings.generations_per_round - self.__state.cur_round_generation + 1)
+        if self.__engine is None:
+            for _ in range(generations):
+                self.Move()
+            return True
         
+        self.__syncEngine()
+        self.__engine.Advance(self.__state.players_turn_queue, generations)
+        self.__state.cur_player_index = len(self.__state.players_turn_queue)
+        self.__exportEngineGrid()
+        self.__setEngineCounts()
+        self.__finishMove(generations)
         return True
     
+    """
+        Move all remaining generations of current round in one go
+        Once board repeats one of round's earlier boards (still life or oscillator),
+        rest of round is looked up in cycle instead of being calculated
+        Engine keeps board to itself for whole round and grid is exported once at round's end
+        (or after every generation, if engine doesn't tell cells changed by generation)
+        Return frames of round: (state version, cells changed by generation) for every generation
+    """
+    def SimulateRound(self) -> list:
+        if self.__state.phase != 1:
+            self.error_message = 'Add cells first, you must'
+            return []
+        
+        self.__state.cycle_period = 0
+        self.__state.cycle_version = 0
+        if self.__engine is not None:
+            self.__syncEngine()
+        first_grid = self.__state.grid
+        is_grid_behind = False
+        frames = []
+        """ Counts of round's generations, hash of board => generations with such board hash """
+        counts = [self.__state.counts[:]]
+        seen = {self.__boardHash(): [0]}
+        cycle_start = period = 0
+        while self.__state.phase == 1:
+            if period:
+                generation = cycle_start + (len(frames) + 1 - cycle_start) % period
+                frame = frames[(generation if generation > cycle_start else generation + period) - 1][1]
+                self.__lookupMove(counts[generation])
+                frames.append((self.__state.version, frame))
+                continue
+            
+            grid = self.__state.grid
+            changes = None
+            if self.__engine is None:
+                self.Move()
+            else:
+                self.__engineMove()
+                self.__finishMove(1)
+                changes = self.__engine.Changes()
+                is_grid_behind = changes is not None
+                if not is_grid_behind:
+                    self.__exportEngineGrid()
+            if changes is None:
+                changes = gridChanges(grid, self.__state.grid)
+            frames.append((self.__state.version, changes))
+            board_hash = self.__boardHash()
+            for generation in seen.get(board_hash, []):
+                if self.__isSameBoard(first_grid, frames, generation):
+                    cycle_start = generation
+                    period = len(frames) - cycle_start
+                    self.__state.cycle_period = period
+                    self.__state.cycle_version = self.__state.version
+                    self.__events.append(('cycle', self.__state.version, [period]))
+                    break
+            else:
+                seen.setdefault(board_hash, []).append(len(frames))
+                counts.append(self.__state.counts[:])
+        
+        if is_grid_behind:
+            self.__exportEngineGrid()
+        """ Looked up generations only set counts, their cells are applied to grid once """
+        if period and len(frames) > cycle_start + period:
+            grid = [row[:] for row in self.__state.grid]
+            for _, changes in frames[cycle_start + period:]:
+                for x, y, cell in changes:
+                    grid[y][x] = cell
+            self.__state.SetTrusted(grid=grid)
+        return frames
+    
+    """ (period, version it was found at) of cycle last simulated round's board settled into, period 0 = no cycle """
+    @property
+    def Cycle(self) -> tuple:
+        return self.__state.cycle_period, self.__state.cycle_version
+    
+    """ Replace game state (e.g. with one calculated elsewhere, along with its events) """
+    def SetState(self, state: GameState, events: list=None):
+        self.__state = state
+        self.__engine_grid = None
+        self.__events += events or []
+        self.__setCountsIfNeeded()
+    
+    """ Take events happened since last call: cells added, generations moved, rounds started, cycles found """
+    def PopEvents(self) -> list:
+        events, self.__events = self.__events, []
+        return events
+    
+    """
+        Apply events (see PopEvents) on top of current state, as they happened,
+        so game can be rebuilt from snapshot of its state and events after it
+    """
+    def Replay(self, events: list) -> bool:
+        for kind, version, data in events:
+            if kind == 'cell':
+                is_applied = self.AddCell(data[0], data[1], data[2])
+            elif kind == 'move':
+                is_applied = self.Move() if data[0] == 1 else self.Advance(data[0])
+            elif kind == 'cycle':
+                self.__state.SetTrusted(cycle_period=data[0], cycle_version=version)
+                is_applied = True
+            else:
+                continue
+            if not is_applied or self.__state.version != version:
+                self.error_message = 'Replay of event {} failed'.format(version)
+                break
+        else:
+            self.error_message = ''
+        self.__events = []
+        return self.error_message == ''
+    
     """ Handler for adding cell on field """
     def AddCell(self, cell_x: int, cell_y: int, player: int) -> bool:
         """ Can only add cells in appropriate phase """
@@ -241,7 +426,12 @@ class GameOfLife:
             return False
         
         self.__state.grid[cell_y][cell_x] = self.__state.players_turn_queue[self.__state.cur_player_index]
+        if self.__engine is not None and self.__engine_grid is self.__state.grid:
+            self.__engine.SetCell(cell_x, cell_y, self.__state.grid[cell_y][cell_x])
+        self.__state.counts[player] += 1
         self.__state.cur_player_added_cells += 1
+        self.__state.version += 1
+        self.__events.append(('cell', self.__state.version, [cell_x, cell_y, player]))
         if self.__state.cur_player_added_cells >= self.__settings.new_cells_per_round:
             self.__state.cur_player_index += 1
             if self.__state.cur_player_index >= len(self.__state.players_turn_queue):
@@ -259,21 +449,6 @@ class GameOfLife:
         else:
             return 'wait'
     
-    """ Check if sent grid (frontend one) is up-to-date """
-    def GridIsActual(self, grid):
-        if len(grid) != len(self.__state.grid):
-            return False
-        
-        for y in range(len(grid)):
-            if len(grid[y]) != len(self.__state.grid[y]):
-                return False
-            for x in range(len(grid[y])):
-                if grid[y][x] != self.__state.grid[y][x]:
-                    return False
-        
-        return True
-    
-
     """ Reset game grid """
     def __resetGrid(self):
         self.__state.grid = []
@@ -287,7 +462,7 @@ class GameOfLife:
         self.__state.players_turn_queue = []
         for p in range(self.__settings.players_number):
             self.__state.players_turn_queue.append(p + 1)
-        random.shuffle(self.__state.players_turn_queue)
+        self.__getRandom().shuffle(self.__state.players_turn_queue)
     
     # ACCP = Alive Cell of Current Player
     """ Get count of cell's neighbors that are ACCP """
@@ -325,6 +500,71 @@ class GameOfLife:
                 c = self.__state.players_turn_queue[self.__state.cur_player_index]
         return c
     
+    """
+        Reload engine if grid was replaced since last sync
+        (grid is only changed in place by AddCell, which notifies engine itself)
+    """
+    def __syncEngine(self):
+        if self.__engine_grid is not self.__state.grid:
+            self.__engine.Load(self.__state.grid)
+            self.__engine_grid = self.__state.grid
+    
+    """
+        Generation(s) moved - count them, log them, check winner and round's end
+        Round's first move forgets cycle of previous round (replayed moves too, see SimulateRound)
+    """
+    def __finishMove(self, generations):
+        if self.__state.cur_round_generation == 1:
+            self.__state.SetTrusted(cycle_period=0, cycle_version=0)
+        self.__state.cur_round_generation += generations
+        self.__state.version += 1
+        self.__events.append(('move', self.__state.version, [generations]))
+        self.__setWinner()
+        self.__endRoundIfNeeded()
+    
+    """ Generation inside engine, state's counts are updated but not its grid (see __exportEngineGrid) """
+    def __engineMove(self):
+        self.__engine.Generation(self.__state.players_turn_queue)
+        self.__state.cur_player_index = len(self.__state.players_turn_queue)
+        self.__setEngineCounts()
+    
+    """ Replace state's grid with engine's one, which engine stays in sync with """
+    def __exportEngineGrid(self):
+        self.__engine_grid = self.__engine.Grid()
+        self.__state.SetTrusted(grid=self.__engine_grid)
+    
+    """ Generation move with already known result (grid is updated by caller) """
+    def __lookupMove(self, counts):
+        self.__state.SetTrusted(counts=counts[:])
+        self.__state.cur_player_index = len(self.__state.players_turn_queue)
+        self.__finishMove(1)
+    
+    """
+        Hash of current board (equal boards, equal hashes): of engine's fingerprint
+        if there is engine (state's grid may be behind it), of packed cells otherwise
+    """
+    def __boardHash(self):
+        if self.__engine is not None:
+            return hash(self.__engine.Fingerprint())
+        return hash(PackedGrid.FromRows(self.__state.grid).ToBytes())
+    
+    """
+        Whether board of round's generation is same as current one (board after last frame):
+        every cell changed since that generation has to be back to its value at that generation
+    """
+    @staticmethod
+    def __isSameBoard(first_grid, frames, generation):
+        current = {}
+        for _, changes in frames[generation:]:
+            for x, y, cell in changes:
+                current[(x, y)] = cell
+        earlier = {(x, y): first_grid[y][x] for x, y in current}
+        for _, changes in frames[:generation]:
+            for x, y, cell in changes:
+                if (x, y) in earlier:
+                    earlier[(x, y)] = cell
+        return earlier == current
+    
     """ Process move of current player, update grid accordingly """
     def __playerMove(self):
         grid = []
@@ -332,27 +572,105 @@ class GameOfLife:
             grid.append([])
             for x in range(len(self.__state.grid[0])):
                 grid[y].append(self.__getCellNewStatus(x, y))
-        self.__state.grid = grid
+        self.__state.SetTrusted(grid=grid)
+    
+    """
+        Process moves of all players at once: neighbors of all players' cells
+        are counted in one pass, then moves are applied in turn order, and
+        counts are only corrected around cells taken over from players yet to move
+        (same result as __playerMove for every player in turn)
+        Players' alive cells counts are updated with births and deaths on the way
+    """
+    def __generationMove(self):
+        grid = [row[:] for row in self.__state.grid]
+        height, width = len(grid), len(grid[0])
+        alive = {player: set() for player in self.__state.players_turn_queue}
+        neighbors = {player: {} for player in self.__state.players_turn_queue}
+        for y, row in enumerate(grid):
+            for x, cell in enumerate(row):
+                if cell in alive:
+                    alive[cell].add((x, y))
+                    self.__addNeighbors(neighbors[cell], x, y, width, height, 1)
+        
+        counts = self.__state.counts
+        for player in self.__state.players_turn_queue:
+            player_alive = alive.pop(player)
+            player_neighbors = neighbors.pop(player)
+            for x, y in player_alive:
+                if not 2 <= player_neighbors.get((x, y), 0) <= 3:
+                    grid[y][x] = 0
+                    counts[player] -= 1
+            for (x, y), count in player_neighbors.items():
+                if count != 3 or (x, y) in player_alive:
+                    continue
+                owner = grid[y][x]
+                if owner in alive:
+                    alive[owner].discard((x, y))
+                    self.__addNeighbors(neighbors[owner], x, y, width, height, -1)
+                if owner != 0:
+                    counts[owner] -= 1
+                grid[y][x] = player
+                counts[player] += 1
+        self.__state.SetTrusted(grid=grid)
+    
+    @staticmethod
+    def __addNeighbors(neighbors, cell_x, cell_y, width, height, value):
+        for dx, dy in SparseEngine.NEIGHBORS_OFFSETS:
+            cell = ((cell_x + dx) % width, (cell_y + dy) % height)
+            neighbors[cell] = neighbors.get(cell, 0) + value
     
 
+    """
+        Random generator of current round, made from game's seed, so game's moves
+        depend only on its state (and can be repeated)
+    """
+    def __getRandom(self) -> random.Random:
+        return random.Random('{}:{}'.format(self.__state.rng_seed, self.__state.cur_round))
+    
+    """ Round generations ended - move to next round """
+    def __endRoundIfNeeded(self):
+        if self.__state.cur_round_generation <= self.__settings.generations_per_round:
+            return
+        
+        self.__state.cur_round += 1
+        self.__state.cur_round_generation = 1
+        if self.IsOver:
+            self.__state.phase = -1
+            return
+        self.__state.phase = 0
+        self.__getRandom().shuffle(self.__state.players_turn_queue)
+        self.__events.append(('round', self.__state.version, [self.__state.cur_round]))
+        self.__state.cur_player_index = 0
+        self.__state.cur_player_added_cells = 0
+    
     """ Calculate counts of players' alive cells """
     def __setCounts(self):
-        self.counts = [0]
+        counts = [0]
         for _ in range(self.__settings.players_number):
-            self.counts.append(0)
+            counts.append(0)
         for row in self.__state.grid:
             for cell in row:
                 if cell > 0:
-                    self.counts[cell] += 1
+                    counts[cell] += 1
+        self.__state.SetTrusted(counts=counts)
+    
+    """ Counts are kept up to date in state, so only states stored without them are counted """
+    def __setCountsIfNeeded(self):
+        if len(self.__state.counts) != self.__settings.players_number + 1:
+            self.__setCounts()
+    
+    def __setEngineCounts(self):
+        engine_counts = self.__engine.Counts()
+        self.__state.SetTrusted(counts=[0] + [engine_counts.get(p, 0) for p in range(1, self.__settings.players_number + 1)])
     
     """ Set game current winner """
     def __setWinner(self):
-        self.__setCounts()
+        counts = self.__state.counts
         self.__state.cur_winner = [0]
-        for i in range(1, len(self.counts)):
-            if self.counts[i] > self.counts[self.__state.cur_winner[0]]:
+        for i in range(1, len(counts)):
+            if counts[i] > counts[self.__state.cur_winner[0]]:
                 self.__state.cur_winner = [i]
-            elif self.counts[i] > 0 and self.counts[i] == self.counts[self.__state.cur_winner[0]]:
+            elif counts[i] > 0 and counts[i] == counts[self.__state.cur_winner[0]]:
                 self.__state.cur_winner.append(i)
     
     
@@ -360,6 +678,25 @@ class GameOfLife:
     def IsOver(self) -> bool:
         return self.__state.cur_round > self.__settings.rounds_number
     
+    @property
+    def Grid(self) -> list:
+        return self.__state.grid
+    
+    """ -1 = inactive, 0 = add cells, 1 = generations move """
+    @property
+    def Phase(self) -> int:
+        return self.__state.phase
+    
+    """ State version, changes every time state does """
+    @property
+    def Version(self) -> int:
+        return self.__state.version
+    
+    """ Players' alive cells numbers, by player id """
+    @property
+    def counts(self) -> list:
+        return self.__state.counts
+    
     @property
     def Winner(self) -> int:
         return self.__state.cur_winner
@@ -383,4 +720,19 @@ class GameOfLife:
             return 'Cell generations proceeding'
         else:
             return 'Player {} adding cells, {} remaining'.format(self.__state.players_turn_queue[self.__state.cur_player_index],
-                                                                 self.__settings.new_cells_per_round - self.__state.cur_player_added_cells)
\ No newline at end of file
+                                                                 self.__settings.new_cells_per_round - self.__state.cur_player_added_cells)
+
+
+""" Make game from settings and state params (parsed JSON), state params are validated unless trusted """
+def getGame(game_settings_params: dict, game_state_params: dict, trusted: bool=True) -> GameOfLife:
+    game_settings = GameSettings(generations_per_round=game_settings_params['generations_per_round'],
+                                 rounds_number=game_settings_params['rounds_number'],
+                                 new_cells_per_round=game_settings_params['new_cells_per_round'])
+    if 'grid_size' in game_settings_params:
+        game_settings.grid_size = tuple(game_settings_params['grid_size'])
+    if 'players_number' in game_settings_params:
+        game_settings.players_number = game_settings_params['players_number']
+
+    game_state = GameState.FromStorage(game_state_params, trusted)
+    
+    return GameOfLife(settings=game_settings, state=game_state, engine=AdaptiveEngine())
@@ -0,0 +1,141 @@
+""" Compact grid representation module """
+import base64
+import struct
+import numpy as np
+
+
+"""
+    Grid packed with 3 bits per cell (player ids 0-7)
+    Every 8 cells take exactly 3 bytes, cells go row by row
+"""
+class PackedGrid:
+    __slots__ = ('__width', '__height', '__data')
+
+    HEADER = struct.Struct('>HH')
+    CELL_BITS = 3
+
+    def __init__(self, width: int, height: int, data: bytes=None):
+        self.__width = width
+        self.__height = height
+        size = self.__groupsNumber(width * height) * self.CELL_BITS
+        if data is None:
+            self.__data = bytearray(size)
+        elif len(data) != size:
+            raise ValueError('Packed grid data size mismatch')
+        else:
+            self.__data = bytearray(data)
+
+    @classmethod
+    def FromRows(cls, rows: list) -> 'PackedGrid':
+        height = len(rows)
+        width = len(rows[0]) if rows else 0
+        return cls.FromArray(np.array(rows, dtype=np.uint8).reshape(height, width))
+
+    @classmethod
+    def FromArray(cls, array: np.ndarray) -> 'PackedGrid':
+        height, width = array.shape
+        cells = np.zeros(cls.__groupsNumber(width * height) * 8, dtype=np.uint32)
+        cells[:width * height] = array.ravel()
+        values = (cells.reshape(-1, 8) << (np.arange(8, dtype=np.uint32) * cls.CELL_BITS)).sum(axis=1, dtype=np.uint32)
+        data = np.stack((values & 0xFF, (values >> 8) & 0xFF, values >> 16), axis=1).astype(np.uint8)
+        return cls(width, height, data.tobytes())
+
+    @classmethod
+    def FromBytes(cls, data: bytes) -> 'PackedGrid':
+        width, height = cls.HEADER.unpack_from(data)
+        return cls(width, height, data[cls.HEADER.size:])
+
+    @classmethod
+    def FromBase64(cls, data: str) -> 'PackedGrid':
+        return cls.FromBytes(base64.b64decode(data))
+
+    def ToArray(self) -> np.ndarray:
+        data = np.frombuffer(self.__data, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+        values = data[:, 0] | (data[:, 1] << 8) | (data[:, 2] << 16)
+        cells = (values[:, None] >> (np.arange(8, dtype=np.uint32) * self.CELL_BITS)) & 7
+        return cells.ravel()[:self.__width * self.__height].astype(np.uint8).reshape(self.__height, self.__width)
+
+    def ToRows(self) -> list:
+        return self.ToArray().tolist()
+
+    def ToBytes(self) -> bytes:
+        return self.HEADER.pack(self.__width, self.__height) + bytes(self.__data)
+
+    def ToBase64(self) -> str:
+        return base64.b64encode(self.ToBytes()).decode('ascii')
+
+    """ Packed data without copying """
+    def Buffer(self) -> memoryview:
+        return memoryview(self.__data)
+
+    @property
+    def Width(self) -> int:
+        return self.__width
+
+    @property
+    def Height(self) -> int:
+        return self.__height
+
+    """ Cell access by (x, y) """
+    def __getitem__(self, cell) -> int:
+        base, shift = self.__position(cell)
+        value = self.__data[base] | (self.__data[base + 1] << 8) | (self.__data[base + 2] << 16)
+        return (value >> shift) & 7
+
+    def __setitem__(self, cell, player: int):
+        if not 0 <= player <= 7:
+            raise ValueError('Cell value must be in 0-7 range')
+        base, shift = self.__position(cell)
+        value = self.__data[base] | (self.__data[base + 1] << 8) | (self.__data[base + 2] << 16)
+        value = (value & ~(7 << shift)) | (player << shift)
+        self.__data[base:base + 3] = bytes((value & 0xFF, (value >> 8) & 0xFF, value >> 16))
+
+    def __len__(self) -> int:
+        return self.__width * self.__height
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, PackedGrid) and self.__width == other.Width
+                and self.__height == other.Height and self.__data == other.Buffer())
+
+    """ Get (first byte of cell's 3-byte group, bit shift inside group) """
+    def __position(self, cell):
+        x, y = cell
+        if not (0 <= x < self.__width and 0 <= y < self.__height):
+            raise IndexError('Cell is out of grid')
+        index = y * self.__width + x
+        return (index >> 3) * 3, (index & 7) * self.CELL_BITS
+
+    @staticmethod
+    def __groupsNumber(cells_number):
+        return (cells_number + 7) // 8
+
+
+""" Cells that differ in new grid from old one, as [x, y, cell] lists """
+def gridChanges(old: list, new: list) -> list:
+    changes = []
+    for y, (old_row, new_row) in enumerate(zip(old, new)):
+        if old_row == new_row:
+            continue
+        for x, (old_cell, new_cell) in enumerate(zip(old_row, new_row)):
+            if old_cell != new_cell:
+                changes.append([x, y, new_cell])
+    return changes
+
+
+""" Run-length encoded grid cells, row by row: [cell, run length, cell, run length, ...] """
+def encodeRLE(grid: list) -> list:
+    runs = []
+    for row in grid:
+        for cell in row:
+            if runs and runs[-2] == cell:
+                runs[-1] += 1
+            else:
+                runs += [cell, 1]
+    return runs
+
+
+def decodeRLE(runs: list, width: int) -> list:
+    cells = []
+    for i in range(0, len(runs), 2):
+        cells += [runs[i]] * runs[i + 1]
+    return [cells[y:y + width] for y in range(0, len(cells), width)]
@@ -0,0 +1,266 @@
+""" Hashlife (memoized quadtree) engine module """
+from game.engines import Engine
+
+
+""" Quadtree node, level 0 nodes are single cells """
+class Node:
+    __slots__ = ('level', 'nw', 'ne', 'sw', 'se', 'cell', 'population')
+
+    def __init__(self, level, nw=None, ne=None, sw=None, se=None, cell=0):
+        self.level = level
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.cell = cell
+        if level == 0:
+            self.population = 1 if cell != 0 else 0
+        else:
+            self.population = nw.population + ne.population + sw.population + se.population
+
+
+"""
+    Hashlife engine
+    Players' moves are sequential, so time is counted in player steps ("substeps"):
+    generation = one substep per player in turn order. Memoized results are keyed
+    by (node, steps, players, phase), where phase is index of player making first substep.
+
+    Grid is a torus, so before every jump it's tiled periodically onto a plane
+    big enough for the light cone not to reach the copied area, then the
+    torus-sized center is read back. Node and result caches are dropped between jumps
+    once they grow over cache_size (never during jump: its recursion relies on them,
+    and nodes have to stay canonical). Caches of one jump are the least size worth
+    setting: e.g. ~25k entries for 50 generations of random 30x20 board, ~220k for
+    100x100; with smaller size caches are only reused within jump, not across jumps.
+"""
+class HashlifeEngine(Engine):
+    __slots__ = ('__width', '__height', '__grid', '__cache_size',
+                 '__nodes', '__results', '__leaves', '__empty')
+
+    def __init__(self, cache_size: int=200000):
+        self.__width = 0
+        self.__height = 0
+        self.__grid = []
+        self.__cache_size = cache_size
+        self.__nodes = {}
+        self.__results = {}
+        self.__leaves = {}
+        self.__empty = []
+
+    def Load(self, grid: list):
+        self.__height = len(grid)
+        self.__width = len(grid[0]) if grid else 0
+        self.__grid = [list(row) for row in grid]
+
+    def SetCell(self, cell_x: int, cell_y: int, player: int):
+        self.__grid[cell_y][cell_x] = player
+
+    def PlayerMove(self, player: int):
+        self.Advance([player], 1)
+
+    def Generation(self, players: list):
+        self.Advance(players, 1)
+
+    """ Jump several generations at once """
+    def Advance(self, players: list, generations: int):
+        if not players or not self.__grid:
+            return
+
+        players = tuple(players)
+        substeps = generations * len(players)
+        phase = 0
+        j = substeps.bit_length() - 1
+        while j >= 0:
+            if substeps & (1 << j):
+                self.__trimCaches()
+                self.__jump(players, phase, j)
+                phase = (phase + (1 << j)) % len(players)
+            j -= 1
+
+    def Grid(self) -> list:
+        return [list(row) for row in self.__grid]
+
+    def Population(self) -> int:
+        return sum(1 for row in self.__grid for cell in row if cell != 0)
+
+    @property
+    def CacheSize(self) -> int:
+        return len(self.__nodes) + len(self.__results)
+
+
+    """ Drop caches grown over their size (empty nodes too, so all nodes stay canonical) """
+    def __trimCaches(self):
+        if len(self.__nodes) + len(self.__results) > self.__cache_size:
+            self.__nodes = {}
+            self.__results = {}
+            self.__empty = []
+
+    """ Move grid 2^j substeps forward """
+    def __jump(self, players, phase, j):
+        level = 2
+        while (1 << (level - 1)) < max(self.__width, self.__height) or level - 2 < j:
+            level += 1
+
+        root = self.__buildTiled(level)
+        result = self.__step(root, j, players, phase)
+
+        grid = [[0] * self.__width for _ in range(self.__height)]
+        self.__readInto(result, 0, 0, grid)
+        self.__grid = grid
+
+    """
+        Build plane node of given level, filled with torus copies
+        so that its center's top left cell is grid's (0, 0)
+    """
+    def __buildTiled(self, level):
+        offset = 1 << (level - 2)
+        width, height = self.__width, self.__height
+        grid = self.__grid
+        built = {}
+
+        """ Prefix sums of alive cells, to skip building empty blocks """
+        sums = [[0] * (width + 1)]
+        for row in grid:
+            sums_row = [0]
+            for x, cell in enumerate(row):
+                sums_row.append(sums_row[x] + (1 if cell != 0 else 0) + sums[-1][x + 1] - sums[-1][x])
+            sums.append(sums_row)
+
+        def rect_population(x0, y0, x1, y1):
+            return sums[y1][x1] - sums[y0][x1] - sums[y1][x0] + sums[y0][x0]
+
+        def block_is_empty(x, y, side):
+            if side > width or side > height:
+                return False
+            x0, y0 = (x - offset) % width, (y - offset) % height
+            population = 0
+            for ya, yb in ((y0, min(y0 + side, height)), (0, max(y0 + side - height, 0))):
+                for xa, xb in ((x0, min(x0 + side, width)), (0, max(x0 + side - width, 0))):
+                    if ya < yb and xa < xb:
+                        population += rect_population(xa, ya, xb, yb)
+            return population == 0
+
+        def build(level, x, y):
+            key = (level, x % width, y % height)
+            if key in built:
+                return built[key]
+            if block_is_empty(x, y, 1 << level):
+                node = self.__emptyNode(level)
+            elif level == 0:
+                node = self.__leaf(grid[(y - offset) % height][(x - offset) % width])
+            else:
+                half = 1 << (level - 1)
+                node = self.__join(build(level - 1, x, y), build(level - 1, x + half, y),
+                                   build(level - 1, x, y + half), build(level - 1, x + half, y + half))
+            built[key] = node
+            return node
+
+        return build(level, 0, 0)
+
+    """ Copy torus-sized part of node (which top left cell is (x, y)) into grid """
+    def __readInto(self, node, x, y, grid):
+        if node.population == 0 or x >= self.__width or y >= self.__height:
+            return
+        if node.level == 0:
+            grid[y][x] = node.cell
+            return
+        half = 1 << (node.level - 1)
+        self.__readInto(node.nw, x, y, grid)
+        self.__readInto(node.ne, x + half, y, grid)
+        self.__readInto(node.sw, x, y + half, grid)
+        self.__readInto(node.se, x + half, y + half, grid)
+
+
+    def __leaf(self, cell):
+        if cell not in self.__leaves:
+            self.__leaves[cell] = Node(0, cell=cell)
+        return self.__leaves[cell]
+
+    def __emptyNode(self, level):
+        while len(self.__empty) <= level:
+            if not self.__empty:
+                self.__empty.append(self.__leaf(0))
+            else:
+                child = self.__empty[-1]
+                self.__empty.append(self.__join(child, child, child, child))
+        return self.__empty[level]
+
+    """ Get canonical node made of given quadrants """
+    def __join(self, nw, ne, sw, se):
+        key = (nw, ne, sw, se)
+        node = self.__nodes.get(key)
+        if node is None:
+            node = self.__nodes[key] = Node(nw.level + 1, nw, ne, sw, se)
+        return node
+
+    """ Center quadrant of node, one level lower """
+    def __center(self, node):
+        return self.__join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    """
+        Center quadrant of level k node after 2^j substeps (j <= k - 2),
+        first substep is made by players[phase]
+    """
+    def __step(self, node, j, players, phase):
+        if node.population == 0:
+            return self.__emptyNode(node.level - 1)
+
+        key = (node, j, players, phase)
+        result = self.__results.get(key)
+        if result is not None:
+            return result
+
+        if node.level == 2:
+            result = self.__baseStep(node, players[phase])
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            parts = [
+                nw, self.__join(nw.ne, ne.nw, nw.se, ne.sw), ne,
+                self.__join(nw.sw, nw.se, sw.nw, sw.ne), self.__center(node), self.__join(ne.sw, ne.se, se.nw, se.ne),
+                sw, self.__join(sw.ne, se.nw, sw.se, se.sw), se,
+            ]
+            if j == node.level - 2:
+                """ Two half-jumps, 2^(k-3) substeps each """
+                half = 1 << (node.level - 3)
+                parts = [self.__step(part, node.level - 3, players, phase) for part in parts]
+                phase = (phase + half) % len(players)
+                step_j = node.level - 3
+            else:
+                """ Smaller jump: no time passes on the first stage """
+                parts = [self.__center(part) for part in parts]
+                step_j = j
+            result = self.__join(
+                self.__step(self.__join(parts[0], parts[1], parts[3], parts[4]), step_j, players, phase),
+                self.__step(self.__join(parts[1], parts[2], parts[4], parts[5]), step_j, players, phase),
+                self.__step(self.__join(parts[3], parts[4], parts[6], parts[7]), step_j, players, phase),
+                self.__step(self.__join(parts[4], parts[5], parts[7], parts[8]), step_j, players, phase),
+            )
+
+        self.__results[key] = result
+        return result
+
+    """ Center 2x2 of 4x4 node after one player's substep, same rules as GameOfLife.__getCellNewStatus """
+    def __baseStep(self, node, player):
+        cells = [[0] * 4 for _ in range(4)]
+        for qy, qx, quadrant in ((0, 0, node.nw), (0, 2, node.ne), (2, 0, node.sw), (2, 2, node.se)):
+            cells[qy][qx] = quadrant.nw.cell
+            cells[qy][qx + 1] = quadrant.ne.cell
+            cells[qy + 1][qx] = quadrant.sw.cell
+            cells[qy + 1][qx + 1] = quadrant.se.cell
+
+        new_cells = []
+        for y in (1, 2):
+            for x in (1, 2):
+                neighbors = 0
+                for ny in (y - 1, y, y + 1):
+                    for nx in (x - 1, x, x + 1):
+                        if (nx != x or ny != y) and cells[ny][nx] == player:
+                            neighbors += 1
+                c = cells[y][x]
+                if c == player:
+                    if not 2 <= neighbors <= 3:
+                        c = 0
+                elif neighbors == 3:
+                    c = player
+                new_cells.append(self.__leaf(c))
+        return self.__join(*new_cells)
@@ -0,0 +1,282 @@
+"""
+    HTTP load test module: simulated players and spectators drive the app end to end
+        python -m game.loadtest --games 10 --spectators 2 --duration 60
+    Every game gets 2 player threads (first one creates game, second one joins it)
+    and spectator threads joining once both players are in; every thread is one
+    logged in test client repeating requests of static/js/game.js, with think time between them
+    Report has latency percentiles, throughput and DB commits per action
+    App runs against temporary SQLite database, unless DATABASE_URL is set
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+
+""" Share-th percentile of values (nearest rank), 0 for no values """
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+""" Per-action latencies, errors and DB commits """
+class LoadStats:
+    __slots__ = ('__latencies', '__errors', '__commits', '__lock', '__current')
+
+    def __init__(self):
+        self.__latencies = {}
+        self.__errors = {}
+        self.__commits = {}
+        self.__lock = threading.Lock()
+        """ Action request of current thread is doing (test client handles request in caller's thread) """
+        self.__current = threading.local()
+
+    """ Run request function as given action, time it; return its result (None if it raised) """
+    def Measure(self, action: str, request):
+        self.__current.action = action
+        start = time.perf_counter()
+        try:
+            response = request()
+            is_error = response.status_code >= 400
+        except Exception:
+            response = None
+            is_error = True
+        finally:
+            self.__current.action = None
+        seconds = time.perf_counter() - start
+        with self.__lock:
+            self.__latencies.setdefault(action, []).append(seconds)
+            if is_error:
+                self.__errors[action] = self.__errors.get(action, 0) + 1
+        return response
+
+    """ DB session committed (SQLAlchemy after_commit listener) """
+    def OnCommit(self, session):
+        action = getattr(self.__current, 'action', None) or 'background'
+        with self.__lock:
+            self.__commits[action] = self.__commits.get(action, 0) + 1
+
+    """ Action => requests, errors, throughput, latency percentiles (ms) and commits per request """
+    def Report(self, duration: float) -> dict:
+        with self.__lock:
+            report = {}
+            for action in sorted(set(self.__latencies) | set(self.__commits)):
+                latencies = self.__latencies.get(action, [])
+                commits = self.__commits.get(action, 0)
+                report[action] = {
+                    'requests': len(latencies),
+                    'errors': self.__errors.get(action, 0),
+                    'per_second': len(latencies) / duration if duration else 0.0,
+                    'p50_ms': percentile(latencies, 0.5) * 1000,
+                    'p99_ms': percentile(latencies, 0.99) * 1000,
+                    'max_ms': max(latencies, default=0.0) * 1000,
+                    'commits': commits,
+                    'commits_per_request': commits / len(latencies) if latencies else None,
+                }
+            return report
+
+
+"""
+    Simulated clients of the app
+    Players and spectators are threads, each with its own test client (own session cookies)
+"""
+class LoadTest:
+    __slots__ = ('__app', '__stats', '__games', '__spectators', '__think_time', '__gen_move_share',
+                 '__settings', '__seed', '__deadline')
+
+    def __init__(self, app, stats: LoadStats, games: int=5, spectators: int=1, think_time: float=0.05,
+                 gen_move_share: float=0.0, settings: dict=None, seed: int=0):
+        self.__app = app
+        self.__stats = stats
+        self.__games = games
+        self.__spectators = spectators
+        self.__think_time = think_time
+        self.__gen_move_share = gen_move_share
+        self.__settings = settings or {'generations_per_round': 10, 'rounds_number': 3, 'new_cells_per_round': 5}
+        self.__seed = seed
+        self.__deadline = 0.0
+
+    """ Run all clients for given time (games in progress are abandoned), return seconds it took """
+    def Run(self, duration: float) -> float:
+        start = time.monotonic()
+        self.__deadline = start + duration
+        threads = []
+        for game in range(self.__games):
+            joined, spectated = queue.Queue(), [queue.Queue() for _ in range(self.__spectators)]
+            threads.append(threading.Thread(target=self.__firstPlayer, args=(game, joined), daemon=True))
+            threads.append(threading.Thread(target=self.__secondPlayer, args=(game, joined, spectated), daemon=True))
+            for spectator, games_queue in enumerate(spectated):
+                threads.append(threading.Thread(target=self.__spectator, args=(game, spectator, games_queue), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - start
+
+
+    """ Create games one after another, hand them over to second player """
+    def __firstPlayer(self, game, joined):
+        rand = random.Random('{}:{}:1'.format(self.__seed, game))
+        client = self.__login('p1-{}'.format(game))
+        while not self.__isOver():
+            response = self.__stats.Measure('new', lambda: client.post('/new', data=self.__settings))
+            if response is None or 'Location' not in response.headers:
+                time.sleep(self.__think_time)
+                continue
+            url = '/game/' + response.headers['Location'].rsplit('/', 1)[1]
+            joined.put(url)
+            while not self.__isOver():
+                status = self.__post(client, url, 'check_p2', {})
+                if status is not None and status.get('p2_ingame'):
+                    break
+            self.__play(client, url, rand)
+
+    """ Join games created by first player, hand them over to spectators """
+    def __secondPlayer(self, game, joined, spectated):
+        rand = random.Random('{}:{}:2'.format(self.__seed, game))
+        client = self.__login('p2-{}'.format(game))
+        while not self.__isOver():
+            url = self.__nextGame(joined)
+            if url is None:
+                continue
+            self.__stats.Measure('join', lambda: client.get(url))
+            for games_queue in spectated:
+                games_queue.put(url)
+            self.__play(client, url, rand)
+
+    def __spectator(self, game, spectator, games_queue):
+        client = self.__login('s{}-{}'.format(spectator, game))
+        while not self.__isOver():
+            url = self.__nextGame(games_queue)
+            if url is None:
+                continue
+            self.__stats.Measure('watch', lambda: client.get(url))
+            """ Page's script starts with waiting for second player, spectators' too """
+            status = None
+            while not self.__isOver() and not (status or {}).get('p2_ingame'):
+                status = self.__post(client, url, 'check_p2', {})
+            self.__play(client, url, None)
+
+    """ Poll game's status like game.js does, add cells on player's turn, until game is over """
+    def __play(self, client, url, rand):
+        version, etag = None, None
+        while not self.__isOver():
+            data = {'version': version, 'frames': True}
+            headers = {'If-None-Match': etag} if etag else {}
+            response = self.__stats.Measure('get_status', lambda: client.post(url, json=dict(data, action='get_status'), headers=headers))
+            if response is None or response.status_code not in (200, 304):
+                time.sleep(self.__think_time)
+                continue
+            etag = response.headers.get('ETag') or etag
+            if response.status_code == 304:
+                time.sleep(self.__think_time)
+                continue
+            status = response.get_json()
+            version = status['version']
+            if status['next_action'] == 'game_over':
+                return
+            if status['next_action'] == 'add_cell' and rand is not None:
+                self.__addCells(client, url, rand)
+            elif rand is not None and rand.random() < self.__gen_move_share:
+                self.__post(client, url, 'gen_move', {})
+            time.sleep(self.__think_time)
+
+    """ Add cells at random places until it's not player's turn anymore """
+    def __addCells(self, client, url, rand):
+        width, height = 30, 20
+        for _ in range(width * height):
+            if self.__isOver():
+                return
+            result = self.__post(client, url, 'add_cell', {'cell_x': rand.randrange(width), 'cell_y': rand.randrange(height)})
+            if result is None:
+                return
+            if not result.get('error') and result['next_action'] != 'add_cell':
+                return
+            time.sleep(self.__think_time)
+
+    def __post(self, client, url, action, data):
+        response = self.__stats.Measure(action, lambda: client.post(url, json=dict(data, action=action)))
+        return response.get_json() if response is not None and response.status_code == 200 else None
+
+    """ Registered and logged in client """
+    def __login(self, name):
+        client = self.__app.test_client()
+        username = 'load-{}-{}'.format(self.__seed, name)[:20]
+        self.__stats.Measure('register', lambda: client.post('/register', data={'username': username, 'password': 'load', 'confirm_password': 'load'}))
+        self.__stats.Measure('login', lambda: client.post('/login', data={'username': username, 'password': 'load'}))
+        return client
+
+    def __nextGame(self, games_queue):
+        try:
+            return games_queue.get(timeout=min(1.0, max(self.__deadline - time.monotonic(), 0.01)))
+        except queue.Empty:
+            return None
+
+    def __isOver(self):
+        return time.monotonic() >= self.__deadline
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m game.loadtest', description='Game HTTP load test')
+    parser.add_argument('--games', type=int, default=5, help='games played at once (2 player clients each)')
+    parser.add_argument('--spectators', type=int, default=1, help='spectator clients per game')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run for')
+    parser.add_argument('--think-time', type=float, default=0.05, help='seconds between client\'s requests (game.js polls every 50ms)')
+    parser.add_argument('--gen-move-share', type=float, default=0.0, help='share of status polls followed by gen_move request')
+    parser.add_argument('--generations', type=int, default=10, help='generations per round')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds per game')
+    parser.add_argument('--cells', type=int, default=5, help='cells added per round')
+    parser.add_argument('--long-poll-timeout', type=float, default=1.0, help='LONG_POLL_TIMEOUT of the app')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write report to (JSON)')
+    args = parser.parse_args(argv)
+
+    if 'DATABASE_URL' not in os.environ:
+        """ App is configured when game package is imported (before this module is), so it takes fresh process """
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='gol-load-'), 'load.db')
+        argv = sys.argv[1:] if argv is None else argv
+        os.execve(sys.executable, [sys.executable, '-m', 'game.loadtest'] + argv, dict(os.environ, DATABASE_URL=database_url))
+
+    from flask_migrate import upgrade
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    from game import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['LONG_POLL_TIMEOUT'] = args.long_poll_timeout
+    with app.app_context():
+        upgrade(directory=os.path.join(os.path.dirname(app.root_path), 'migrations'))
+
+    stats = LoadStats()
+    event.listen(Session, 'after_commit', stats.OnCommit)
+    settings = {'generations_per_round': args.generations, 'rounds_number': args.rounds, 'new_cells_per_round': args.cells}
+    load_test = LoadTest(app, stats, args.games, args.spectators, args.think_time, args.gen_move_share, settings, args.seed)
+    duration = load_test.Run(args.duration)
+    event.remove(Session, 'after_commit', stats.OnCommit)
+
+    report = stats.Report(duration)
+    print('{:<12} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8} {:>12}'.format(
+        'action', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'commits', 'commits/req'))
+    for action, row in report.items():
+        commits_per_request = '-' if row['commits_per_request'] is None else '{:.2f}'.format(row['commits_per_request'])
+        print('{:<12} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8} {:>12}'.format(
+            action, row['requests'], row['errors'], row['per_second'], row['p50_ms'], row['p99_ms'], row['max_ms'],
+            row['commits'], commits_per_request))
+    total = sum(row['requests'] for row in report.values())
+    print('{} requests in {:.1f}s ({:.1f} req/s); get_status latency includes long-poll wait'.format(total, duration, total / duration))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'duration': duration, 'args': vars(args), 'actions': report}, output, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
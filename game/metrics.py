@@ -0,0 +1,227 @@
+""" Timing metrics and profiling module """
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+from flask import g, has_app_context
+
+
+""" Distribution of durations in fixed buckets (seconds) """
+class Histogram:
+    __slots__ = ('__counts', '__count', '__sum', '__max')
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        """ One count per bucket, last one is for durations over all buckets """
+        self.__counts = [0] * (len(self.BUCKETS) + 1)
+        self.__count = 0
+        self.__sum = 0.0
+        self.__max = 0.0
+
+    def Observe(self, seconds: float):
+        bucket = 0
+        while bucket < len(self.BUCKETS) and seconds > self.BUCKETS[bucket]:
+            bucket += 1
+        self.__counts[bucket] += 1
+        self.__count += 1
+        self.__sum += seconds
+        self.__max = max(self.__max, seconds)
+
+    """ Upper bound of bucket share-th duration falls in (max duration for last bucket) """
+    def Quantile(self, share: float) -> float:
+        rank = share * self.__count
+        total = 0
+        for bucket, count in enumerate(self.__counts):
+            total += count
+            if count and total >= rank:
+                return self.BUCKETS[bucket] if bucket < len(self.BUCKETS) else self.__max
+        return 0.0
+
+    """ Count, sum, max, p50/p99 estimates and cumulative bucket counts (bucket's upper bound => count) """
+    def ToDict(self) -> dict:
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.BUCKETS + ('+Inf',), self.__counts):
+            total += count
+            buckets[str(bound)] = total
+        return {
+            'count': self.__count,
+            'sum': self.__sum,
+            'max': self.__max,
+            'p50': self.Quantile(0.5),
+            'p99': self.Quantile(0.99),
+            'buckets': buckets,
+        }
+
+
+"""
+    Timings of units of work (requests, scheduler's ticks), broken down by phase
+    Unit's state is kept in flask.g, so it's per app context
+    Phases may be nested, time of inner phase only counts for inner one;
+    time outside of any phase counts as 'other'
+    Every unit adds its total to '<action>' histogram and phases to '<action>.<phase>' ones
+"""
+class Metrics:
+    __slots__ = ('__histograms', '__lock')
+
+    def __init__(self):
+        self.__histograms = collections.defaultdict(Histogram)
+        self.__lock = threading.Lock()
+
+    def Observe(self, name: str, seconds: float):
+        with self.__lock:
+            self.__histograms[name].Observe(seconds)
+
+    """ Start timing unit of work under given action (must be called within app context) """
+    def Start(self, action: str):
+        g.metrics = {'action': action, 'start': time.perf_counter(), 'phases': {}, 'stack': []}
+
+    """ Rename current unit's action (e.g. once request is parsed) """
+    def SetAction(self, action: str):
+        unit = self.__unit()
+        if unit is not None:
+            unit['action'] = action
+
+    """ Time code inside with-block as given phase of current unit (does nothing outside of one) """
+    @contextlib.contextmanager
+    def Phase(self, name: str):
+        self.EnterPhase(name)
+        try:
+            yield
+        finally:
+            self.ExitPhase(name)
+
+    """ Phase start and end, for callbacks that can't use with-block (see TimeQueries) """
+    def EnterPhase(self, name: str):
+        unit = self.__unit()
+        if unit is not None:
+            """ [phase, start time, time spent in nested phases] """
+            unit['stack'].append([name, time.perf_counter(), 0.0])
+
+    def ExitPhase(self, name: str):
+        unit = self.__unit()
+        if unit is None or not unit['stack'] or unit['stack'][-1][0] != name:
+            return
+        name, start, nested = unit['stack'].pop()
+        spent = time.perf_counter() - start
+        unit['phases'][name] = unit['phases'].get(name, 0.0) + spent - nested
+        if unit['stack']:
+            unit['stack'][-1][2] += spent
+
+    """ Record current unit's timings and stop timing it """
+    def Finish(self):
+        unit = self.__unit()
+        if unit is None:
+            return
+        g.metrics = None
+        total = time.perf_counter() - unit['start']
+        phases = dict(unit['phases'])
+        phases['other'] = max(total - sum(phases.values()), 0.0)
+        with self.__lock:
+            self.__histograms[unit['action']].Observe(total)
+            for name, seconds in phases.items():
+                self.__histograms['{}.{}'.format(unit['action'], name)].Observe(seconds)
+
+    """ Count time of every SQL statement and session's commit as 'db' phase of unit it runs in """
+    def TimeQueries(self, engine, session):
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', lambda *args: self.EnterPhase('db'))
+        event.listen(engine, 'after_cursor_execute', lambda *args: self.ExitPhase('db'))
+        """ Failed statement doesn't get to after_cursor_execute """
+        event.listen(engine, 'handle_error', lambda *args: self.ExitPhase('db'))
+        """ Commit itself isn't a statement, but it's often the slowest part (e.g. SQLite syncing file) """
+        event.listen(session, 'before_commit', lambda *args: self.EnterPhase('db'))
+        event.listen(session, 'after_transaction_end', lambda *args: self.ExitPhase('db'))
+
+    """ Histogram name => its data (see Histogram.ToDict) """
+    def ToDict(self) -> dict:
+        with self.__lock:
+            return {name: histogram.ToDict() for name, histogram in sorted(self.__histograms.items())}
+
+    def Reset(self):
+        with self.__lock:
+            self.__histograms.clear()
+
+    @staticmethod
+    def __unit():
+        return g.get('metrics') if has_app_context() else None
+
+
+"""
+    Sampling profiler of work done for particular game
+    Threads mark game they're working on (Enter/Exit, cheap when nothing is sampled);
+    while sampling, stacks of threads working on sampled game are taken at interval
+"""
+class SamplingProfiler:
+    __slots__ = ('__threads', '__root')
+
+    """ Frames deeper than that aren't taken """
+    MAX_DEPTH = 64
+
+    def __init__(self, root: str=None):
+        """ thread id => id of game thread works on """
+        self.__threads = {}
+        """ Paths inside root are shown relative to it """
+        self.__root = root
+
+    def Enter(self, game_id: int):
+        self.__threads[threading.get_ident()] = game_id
+
+    def Exit(self):
+        self.__threads.pop(threading.get_ident(), None)
+
+    """
+        Sample stacks of threads working on game for given time (blocks meanwhile)
+        Return report: samples number, hottest functions by samples they're on stack in
+        and by samples they're on top of stack in, and hottest whole stacks
+        Functions are named by where they start ('file:first line function'), so samples
+        at any of function's lines count for it; stacks have lines samples were taken at
+    """
+    def Sample(self, game_id: int, seconds: float, interval: float=0.005, top: int=20) -> dict:
+        stacks = collections.Counter()
+        samples = 0
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for thread_id, thread_game_id in list(self.__threads.items()):
+                if thread_game_id != game_id or thread_id == own_thread or thread_id not in frames:
+                    continue
+                stacks[self.__stack(frames[thread_id])] += 1
+                samples += 1
+            del frames
+            time.sleep(interval)
+
+        total, own, paths = collections.Counter(), collections.Counter(), collections.Counter()
+        for stack, count in stacks.items():
+            for function in set(function for function, _ in stack):
+                total[function] += count
+            if stack:
+                own[stack[-1][0]] += count
+            paths[tuple(location for _, location in stack)] += count
+        return {
+            'game_id': game_id,
+            'seconds': seconds,
+            'samples': samples,
+            'functions': [{'function': function, 'total': count, 'own': own[function]}
+                          for function, count in total.most_common(top)],
+            'own_functions': [{'function': function, 'total': total[function], 'own': count}
+                              for function, count in own.most_common(top)],
+            'hot_paths': [{'stack': list(stack), 'samples': count} for stack, count in paths.most_common(top)],
+        }
+
+    """ Frames of stack as ('file:first line function', 'file:line function') pairs, outermost first """
+    def __stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.MAX_DEPTH:
+            code = frame.f_code
+            path = code.co_filename
+            if self.__root is not None and path.startswith(self.__root):
+                path = os.path.relpath(path, self.__root)
+            stack.append(('{}:{} {}'.format(path, code.co_firstlineno, code.co_name),
+                          '{}:{} {}'.format(path, frame.f_lineno, code.co_name)))
+            frame = frame.f_back
+        return tuple(reversed(stack))
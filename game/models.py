@@ -17,17 +17,69 @@ class User(db.Model, UserMixin):
 class Game(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    first_player_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    second_player_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    status = db.Column(db.Integer, nullable=False, default=0)
+    first_player_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    second_player_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    status = db.Column(db.Integer, nullable=False, default=0, index=True)
     settings = db.Column(db.String(1000))
-    state = db.Column(db.String(1000))
+    # state version of last write, every write is conditional on it (compare-and-swap, see store.saveGameState)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # load them along with games (joinedload), otherwise every game's repr queries them
+    first_player = db.relationship('User', foreign_keys=[first_player_id])
+    second_player = db.relationship('User', foreign_keys=[second_player_id])
 
     def __repr__(self):
         status = ['open', 'active', 'finished'][self.status]
-        player_1 = load_user(self.first_player_id).username
-        player_2 = User.query.filter_by(id=self.second_player_id).first()
-        if player_2:
-            return f"{player_1} vs {player_2.username}, {status} ({self.date_created}))"
+        player_1 = self.first_player.username
+        if self.second_player:
+            return f"{player_1} vs {self.second_player.username}, {status} ({self.date_created}))"
         else:
-            return f"{player_1}, {status} ({self.date_created}))"
\ No newline at end of file
+            return f"{player_1}, {status} ({self.date_created}))"
+
+class GameStateEntry(db.Model):
+    # latest snapshot of game state, later changes are in game events
+    __tablename__ = 'game_state'
+    # layout of stored state, bumped on incompatible changes
+    SCHEMA_VERSION = 1
+
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), primary_key=True)
+    schema_version = db.Column(db.Integer, nullable=False, default=SCHEMA_VERSION)
+    # packed grid, see PackedGrid.ToBytes
+    grid = db.Column(db.LargeBinary, nullable=False)
+    # all other state params as JSON
+    params = db.Column(db.Text, nullable=False)
+    date_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"GameStateEntry(game {self.game_id}, schema {self.schema_version})"
+
+class GameEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), nullable=False, index=True)
+    # game state version after event
+    version = db.Column(db.Integer, nullable=False)
+    # 'cell', 'move', 'round' or 'cycle', see GameOfLife.PopEvents
+    kind = db.Column(db.String(8), nullable=False)
+    # event params as JSON list
+    data = db.Column(db.String(100), nullable=False)
+
+    def __repr__(self):
+        return f"GameEvent(game {self.game_id}, {self.kind} {self.data} -> {self.version})"
+
+class GenerationJob(db.Model):
+    # statuses
+    PENDING = 0
+    RUNNING = 1
+    DONE = 2
+
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), unique=True, nullable=False)
+    status = db.Column(db.Integer, nullable=False, default=0)
+    # scheduler moving game's generations and time its claim expires (unless renewed), see GenerationScheduler
+    lease_owner = db.Column(db.String(64))
+    lease_until = db.Column(db.DateTime)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        status = ['pending', 'running', 'done'][self.status]
+        return f"GenerationJob(game {self.game_id}, {status})"
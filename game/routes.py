@@ -1,11 +1,35 @@
-from flask import flash, render_template, url_for, request, json, jsonify, make_response, redirect
+import threading
+from functools import wraps
+from flask import flash, render_template, url_for, request, jsonify, make_response, redirect
 from flask_login import login_user, logout_user, current_user, login_required
-from game import app, db, bcrypt
+from game import app, db, bcrypt, game_cache, game_events, lobby_games_count, metrics, profiler, scheduler, simulation_pool, user_names
+from game.cache import CachedGame
 from game.forms import RegistrationForm, LoginForm, NewGameForm
-from game.game import GameOfLife, GameSettings, GameState
+from game.game import GameOfLife, GameSettings
+from game.grid import encodeRLE
 from game.models import User, Game
-from time import sleep
-import random
+from game.store import GameConflictError, GameRecoveryError, addGame, changeGame, getCachedGame, getGamesPage, getUserName
+
+GAME_ACTIONS = ('check_p2', 'add_cell', 'get_status', 'gen_move')
+""" Held while profiler samples, so only one request at a time is kept busy by it """
+profile_lock = threading.Lock()
+
+""" Generations scheduler starts with first request, so CLI commands (like migrations) don't run it """
+@app.before_request
+def startScheduler():
+    scheduler.Start()
+
+""" Every request is timed (see Metrics), requests of game are marked for profiler """
+@app.before_request
+def startMetrics():
+    metrics.Start(request.endpoint or 'not_found')
+    if request.endpoint == 'game' and str(request.view_args.get('id')).isdigit():
+        profiler.Enter(int(request.view_args['id']))
+
+@app.teardown_request
+def finishMetrics(exception):
+    metrics.Finish()
+    profiler.Exit()
 
 @app.route("/")
 @app.route("/home")
@@ -50,9 +74,15 @@ def logout():
 @app.route("/lobby")
 @login_required
 def lobby():
-    open_games = Game.query.filter(Game.status!=-1)
-    own_games = Game.query.filter(((Game.first_player_id==current_user.id)|(Game.second_player_id==current_user.id))&(Game.status!=-1))
-    return render_template('lobby.html', open_games=open_games, own_games=own_games)
+    page_size = app.config['LOBBY_PAGE_SIZE']
+    open_before = request.args.get('open_before', type=int)
+    own_before = request.args.get('own_before', type=int)
+    open_games, open_next = getGamesPage(Game.status!=-1, open_before, page_size)
+    own_games, own_next = getGamesPage(((Game.first_player_id==current_user.id)|(Game.second_player_id==current_user.id))&(Game.status!=-1),
+                                       own_before, page_size)
+    open_games_count = lobby_games_count.Get(lambda: db.session.query(db.func.count(Game.id)).filter(Game.status!=-1).scalar())
+    return render_template('lobby.html', open_games=open_games, own_games=own_games, open_games_count=open_games_count,
+                           open_before=open_before, own_before=own_before, open_next=open_next, own_next=own_next)
 
 @app.route("/new", methods=['GET','POST'])
 @login_required
@@ -63,103 +93,141 @@ def new():
                                      rounds_number=form.rounds_number.data,
                                      new_cells_per_round=form.new_cells_per_round.data)
         game = GameOfLife(settings=game_settings)
-        game_db = Game(first_player_id=current_user.id,
-                        settings=game_settings.ToJSON(),
-                        state=game._GameOfLife__state.ToJSON())
-        db.session.add(game_db)
-        db.session.commit()
+        game_db = addGame(game, current_user.id)
         return redirect('/game/%d' % game_db.id)
     return render_template('new_game.html', form=form)
 
 @app.route("/game/<id>", methods=['GET','POST'])
 @login_required
 def game(id):
-    game_db = Game.query.filter_by(id=id).first()
-    if game_db == None:
+    try:
+        cached = getCachedGame(id)
+    except GameRecoveryError:
+        if request.method == 'GET':
+            flash(f'This game could not be loaded', 'danger')
+            return redirect(url_for('lobby'))
+        return make_response(jsonify({'error': True, 'message': "Lost, this game's history is"}), 200)
+    if cached == None:
         flash(f'This game does not exist', 'danger')
         return redirect(url_for('lobby'))
     
-    game = getGameFromEntry(game_db)
-    if current_user.id == game_db.first_player_id:
+    game = cached.game
+    if current_user.id == cached.first_player_id:
         player_num = 1
-    elif current_user.id == game_db.second_player_id:
+    elif current_user.id == cached.second_player_id:
         player_num = 2
     else:
         player_num = 0
 
     if request.method == 'GET':
-        player_1 = User.query.filter_by(id=game_db.first_player_id).first().username
-        if player_num == 0 and game_db.second_player_id is None:
-            game_db.second_player_id = current_user.id
-            game_db.status = 1
-            db.session.commit()
-            player_2 = current_user.username
-        elif game_db.second_player_id == None:
-            player_2 = 'None'
-        else:
-            player_2 = User.query.filter_by(id=game_db.second_player_id).first()
-            player_2 = player_2.username if player_2 else 'None'
-        gameboard_class = '_mod-addcell' if game.GetNextAction(player_num) == 'add_cell' else ''
-        return render_template('game.html',
-                                player_1=player_1,
-                                player_2=player_2,
-                                grid=json.loads(game_db.state)['grid'],
-                                status=game.Status,
-                                gameboard_class=gameboard_class)
+        metrics.SetAction('game.page')
+        joined = False
+        if player_num == 0 and cached.second_player_id is None:
+            """ Free seat is taken in one conditional update, so only one of users joining at once gets it """
+            with cached.lock:
+                joined = Game.query.filter_by(id=cached.id, second_player_id=None) \
+                                   .update({'second_player_id': current_user.id, 'status': 1}) == 1
+                db.session.commit()
+                if joined:
+                    cached.second_player_id = current_user.id
+                    cached.status = 1
+                    user_names.Put(current_user.id, current_user.username)
+                    game_cache.Touch(cached)
+            if joined:
+                game_events.Notify(cached.id)
+            else:
+                """ Someone else was faster, cached game doesn't know who """
+                game_cache.Invalidate(cached.id)
+        player_1 = getUserName(cached.first_player_id)
+        player_2 = current_user.username if joined else getUserName(cached.second_player_id) or 'None'
+        """ Grid and version are taken together (mid-round, grid is only updated at round's end) """
+        with cached.lock:
+            grid = [row[:] for row in game._GameOfLife__state.grid]
+            status = game.Status
+            version = game.Version
+            gameboard_class = '_mod-addcell' if game.GetNextAction(player_num) == 'add_cell' else ''
+        with metrics.Phase('render'):
+            return render_template('game.html',
+                                    player_1=player_1,
+                                    player_2=player_2,
+                                    grid=grid,
+                                    status=status,
+                                    gameboard_class=gameboard_class,
+                                    version=version,
+                                    playback_interval=int(app.config['GENERATION_INTERVAL'] * 1000))
     
+    """ Spectators get same answers as players (add_cell checks who's adding) """
     req = request.get_json()
-    if player_num == 0:
-        req['action'] = 'get_state'
     response = {}
+    """ Unknown actions share one name, so clients can't make up new metrics """
+    metrics.SetAction('game.' + (req['action'] if req['action'] in GAME_ACTIONS else 'unknown'))
 
     if req['action'] == 'check_p2':
-        if game_db.second_player_id != None:
+        if cached.second_player_id == None:
+            with metrics.Phase('wait'):
+                game_events.Wait(cached.id, lambda: cached.second_player_id != None, app.config['LONG_POLL_TIMEOUT'])
+        if cached.second_player_id != None:
             response['p2_ingame'] = True
-            response['p2_name'] = User.query.filter_by(id=game_db.second_player_id).first().username
+            response['p2_name'] = getUserName(cached.second_player_id)
         else:
             response['p2_ingame'] = False
     elif req['action'] == 'add_cell':
-        if current_user.id != game_db.first_player_id and current_user.id != game_db.second_player_id:
+        if current_user.id != cached.first_player_id and current_user.id != cached.second_player_id:
             return make_response(jsonify({'error': True, 'message': 'Not a player, you are'}), 200)
         if not ('cell_x' in req and 'cell_y' in req):
             return make_response(jsonify({'error': True, 'message': 'Not provided, cell coordinates are'}), 200)
         
-        if game.AddCell(req['cell_x'], req['cell_y'], player_num):
-            game_db.state = game._GameOfLife__state.ToJSON()
-            db.session.commit()
+        def addCell(game):
+            with metrics.Phase('simulate'):
+                return game.AddCell(req['cell_x'], req['cell_y'], player_num)
+        try:
+            cached, cell_added, version = changeGame(cached, addCell)
+        except GameConflictError:
+            return make_response(jsonify({'error': True, 'message': 'Changed meanwhile, game was; again, try you must'}), 200)
+        except GameRecoveryError:
+            return make_response(jsonify({'error': True, 'message': "Lost, this game's history is"}), 200)
+        game = cached.game
+        if cell_added:
+            response['version'] = version
             response['cell_class'] = 'cell-p{}'.format(player_num)
             response['counts_class'] = '_p{}_counts'.format(player_num)
-            response['next_action'] = game.GetNextAction(player_num)
-            response['status'] = game.Status
-            if game._GameOfLife__state.phase == 1:
-                response['send_gen_move'] = True
+            with cached.lock:
+                response['next_action'] = game.GetNextAction(player_num)
+                response['status'] = game.Status
+                is_moving = game.Phase == 1
+            if is_moving:
+                scheduler.Submit(cached.id)
         else:
             response['error'] = True
             response['message'] = game.error_message or 'Cell there, cannot you add'
     elif req['action'] == 'get_status':
-        response['next_action'] = game.GetNextAction(player_num)
-        alive_cells_counts = game.counts
-        response['p1_cells'] = alive_cells_counts[1]
-        response['p2_cells'] = alive_cells_counts[2]
-        response['status'] = game.Status
-        if response['next_action'] == 'add_cell':
-            need_grid_in_response = True
-            gameboard_class = '_mod-addcell'
-        else:
-            gameboard_class = ''
-            need_grid_in_response = not 'gameboard' in req or not game.GridIsActual(json.loads(req['gameboard']))
-        if need_grid_in_response:
-            response['gameboard'] = render_template('gameboard.html',
-                                                    grid=game._GameOfLife__state.grid,
-                                                    gameboard_class=gameboard_class)
+        """ Long-poll: hold request until game changes from client's version (or timeout passes) """
+        if game.GetNextAction(player_num) == 'wait' and req.get('version') == game.Version:
+            with metrics.Phase('wait'):
+                game_events.Wait(cached.id, lambda: game.Version != req['version'], app.config['LONG_POLL_TIMEOUT'])
+        
+        """ Status depends only on state version and player, it's read at once (scheduler moves round under game's lock) """
+        with cached.lock:
+            etag = 'status-{}-{}'.format(game.Version, player_num)
+            if request.if_none_match.contains(etag):
+                status_response = make_response('', 304)
+            else:
+                with metrics.Phase('encode'):
+                    response['next_action'] = game.GetNextAction(player_num)
+                    alive_cells_counts = game.counts
+                    response['p1_cells'] = alive_cells_counts[1]
+                    response['p2_cells'] = alive_cells_counts[2]
+                    response['status'] = game.Status
+                    """ Board settled into cycle, frames after cycle_version only repeat it """
+                    response['cycle_period'], response['cycle_version'] = game.Cycle
+                    response.update(getGridUpdate(cached, req.get('version'), req.get('frames', False)))
+                    status_response = make_response(jsonify(response), 200)
+        status_response.set_etag(etag)
+        return status_response
     elif req['action'] == 'gen_move':
-        while game._GameOfLife__state.phase == 1:
-            game.Move()
-            game_db.state = game._GameOfLife__state.ToJSON()
-            if game._GameOfLife__state.phase == -1:
-                game_db.status = 2
-            db.session.commit()
-            sleep(0.3)
+        """ Generations are moved by scheduler, this only makes sure game's job is on """
+        if game.Phase == 1:
+            scheduler.Submit(cached.id)
         response['success'] = True
     else:
         response['error'] = True
@@ -168,18 +236,76 @@ def game(id):
     return make_response(jsonify(response), 200)
 
 
-def getGameFromEntry(game_entry: Game) -> GameOfLife:
-    if not isinstance(game_entry, Game):
-        return None
-    
-    game_settings = json.loads(game_entry.settings)
-    game_settings = GameSettings(generations_per_round=game_settings['generations_per_round'],
-                                 rounds_number=game_settings['rounds_number'],
-                                 new_cells_per_round=game_settings['new_cells_per_round'])
-    
-    game_state_params = json.loads(game_entry.state)
-    game_state = GameState()
-    for param in game_state_params:
-        game_state.__setattr__(param, game_state_params[param])
-    
-    return GameOfLife(settings=game_settings, state=game_state)
\ No newline at end of file
+""" Server internals are only shown to operators (see OPERATOR_IDS) """
+def operator_required(view):
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if current_user.id not in app.config['OPERATOR_IDS']:
+            return make_response(jsonify({'error': True, 'message': 'Operators only'}), 403)
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+""" Simulation workers' stats (empty if games are simulated in-process) """
+@app.route("/metrics/simulation")
+@login_required
+@operator_required
+def simulation_metrics():
+    return make_response(jsonify(getSimulationStats()), 200)
+
+
+"""
+    Timing histograms of requests (by endpoint or game action) and scheduler's ticks,
+    total and by phase (see Metrics), along with simulation stats
+"""
+@app.route("/metrics")
+@login_required
+@operator_required
+def timing_metrics():
+    return make_response(jsonify({
+        'timings': metrics.ToDict(),
+        'simulation': getSimulationStats(),
+        'cached_games': len(game_cache),
+    }), 200)
+
+
+""" Hot paths of game's requests and generations sampled for given time (?seconds=N, PROFILING must be on) """
+@app.route("/metrics/profile/<int:game_id>")
+@login_required
+@operator_required
+def game_profile(game_id):
+    if not app.config['PROFILING']:
+        return make_response(jsonify({'error': True, 'message': 'Profiling is disabled'}), 404)
+    seconds = min(request.args.get('seconds', 5.0, type=float), app.config['PROFILE_MAX_SECONDS'])
+    if not profile_lock.acquire(blocking=False):
+        return make_response(jsonify({'error': True, 'message': 'Profiler is busy'}), 409)
+    try:
+        return make_response(jsonify(profiler.Sample(game_id, seconds)), 200)
+    finally:
+        profile_lock.release()
+
+
+def getSimulationStats() -> dict:
+    workers = simulation_pool.Stats() if simulation_pool is not None else []
+    return {'workers': workers, 'scheduler_queue': scheduler.QueueSize}
+
+
+"""
+    Grid changes since client's version of game: changed cells (or changes of every
+    version, if client plays frames back) if they're still in history,
+    whole run-length encoded grid otherwise
+"""
+def getGridUpdate(cached: CachedGame, version, frames: bool=False) -> dict:
+    with cached.lock:
+        update = {'version': cached.game.Version}
+        if version == cached.game.Version:
+            return update
+        changes = None
+        if isinstance(version, int):
+            changes = cached.history.FramesSince(version) if frames else cached.history.ChangesSince(version)
+        if changes is not None:
+            update['frames' if frames else 'changes'] = changes
+        else:
+            grid = cached.game.Grid
+            update['frame'] = {'width': len(grid[0]), 'height': len(grid), 'rle': encodeRLE(grid)}
+        return update
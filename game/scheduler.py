@@ -0,0 +1,216 @@
+""" Background generations scheduler module """
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from game import db, game_cache, metrics, profiler
+from game.models import GenerationJob
+from game.store import GameConflictError, GameRecoveryError, getCachedGame, saveGameState
+from game.workers import SimulationPool
+
+logger = logging.getLogger(__name__)
+
+
+"""
+    Owns generation moves of all games in generations-step phase
+    Games due for their next generations are kept in time-ordered queue
+    and handed over to worker threads, which calculate whole round at once
+    (clients play round's frames back at their own pace), so no thread is
+    held while game waits
+    Jobs are stored in DB, so unfinished ones are resumed on startup
+    With simulation pool, generations are calculated in worker processes
+    If several processes run schedulers, game is only moved by one holding
+    its job's lease; lease is renewed every tick, others take it over once it expires
+"""
+class GenerationScheduler:
+    __slots__ = ('__app', '__workers', '__interval', '__retry_interval', '__lease_ttl', '__owner',
+                 '__simulation_pool', '__executor', '__thread', '__queue', '__active', '__condition', '__started')
+
+    def __init__(self, app, workers: int=4, interval: float=0.3, retry_interval: float=5.0,
+                 lease_ttl: float=30.0, simulation_pool: SimulationPool=None):
+        self.__app = app
+        self.__simulation_pool = simulation_pool
+        self.__workers = workers
+        self.__interval = interval
+        self.__retry_interval = retry_interval
+        self.__lease_ttl = lease_ttl
+        """ Lease owner name, unique among schedulers of all processes """
+        self.__owner = '{}:{}:{}'.format(socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:8])
+        self.__executor = None
+        self.__thread = None
+        """ (due time, game id) heap """
+        self.__queue = []
+        """ game id => whether its job is marked as running in DB """
+        self.__active = {}
+        self.__condition = threading.Condition()
+        self.__started = False
+
+    """ Start scheduler and resume unfinished jobs (only first call does anything) """
+    def Start(self):
+        with self.__condition:
+            if self.__started:
+                return
+            self.__started = True
+        self.__startThreads()
+        with self.__app.app_context():
+            try:
+                jobs = GenerationJob.query.filter(GenerationJob.status != GenerationJob.DONE).all()
+            except SQLAlchemyError:
+                logger.exception('Unfinished generation jobs could not be loaded')
+                return
+            for job in jobs:
+                self.__enqueue(job.game_id, job.status == GenerationJob.RUNNING)
+
+    """
+        Request generation moves for game (must be called within app context)
+        Does nothing if game's job is already on
+        Job is stored by saveGameState along with game's generations-step phase already,
+        this puts it on in this process
+    """
+    def Submit(self, game_id: int) -> bool:
+        if self.IsActive(game_id):
+            return False
+
+        pend = lambda: GenerationJob.query.filter_by(game_id=game_id).update({'status': GenerationJob.PENDING})
+        if pend() == 0:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(GenerationJob(game_id=game_id, status=GenerationJob.PENDING))
+            except IntegrityError:
+                """ Concurrent first submit inserted game's job meanwhile """
+                pend()
+        db.session.commit()
+
+        self.__startThreads()
+        return self.__enqueue(game_id, False)
+
+    def IsActive(self, game_id: int) -> bool:
+        with self.__condition:
+            return game_id in self.__active
+
+    @property
+    def QueueSize(self) -> int:
+        return len(self.__queue)
+
+
+    def __startThreads(self):
+        with self.__condition:
+            if self.__thread is not None:
+                return
+            self.__executor = ThreadPoolExecutor(self.__workers, thread_name_prefix='generations')
+            self.__thread = threading.Thread(target=self.__dispatch, name='generations-dispatcher', daemon=True)
+            self.__thread.start()
+
+    def __enqueue(self, game_id, is_running, delay=0.0) -> bool:
+        with self.__condition:
+            if game_id in self.__active:
+                return False
+            self.__active[game_id] = is_running
+            heapq.heappush(self.__queue, (time.monotonic() + delay, game_id))
+            self.__condition.notify()
+        return True
+
+    """ Hand games over to workers once they're due """
+    def __dispatch(self):
+        while True:
+            with self.__condition:
+                while not self.__queue or self.__queue[0][0] > time.monotonic():
+                    timeout = self.__queue[0][0] - time.monotonic() if self.__queue else None
+                    self.__condition.wait(timeout)
+                _, game_id = heapq.heappop(self.__queue)
+            self.__executor.submit(self.__tick, game_id)
+
+    """ Move all generations of game's round, then schedule next move if game is still in generations-step phase """
+    def __tick(self, game_id):
+        with self.__condition:
+            is_running = self.__active[game_id]
+        delay = self.__interval
+        has_next = False
+        with self.__app.app_context():
+            metrics.Start('scheduler.tick')
+            profiler.Enter(game_id)
+            try:
+                leased = self.__takeLease(game_id)
+                cached = getCachedGame(game_id) if leased else None
+                if cached is not None:
+                    with cached.lock:
+                        if cached.game.Phase == 1:
+                            with metrics.Phase('simulate'):
+                                frames = self.__simulateRound(game_id, cached.game)
+                            cached.history.RecordFrames(frames, cached.game.Grid)
+                            saveGameState(cached)
+                        has_next = cached.game.Phase == 1
+                if (not has_next or not leased) and self.__simulation_pool is not None:
+                    """ Game waits for players (or is over, or moved elsewhere), its worker's copy would go stale anyway """
+                    self.__simulation_pool.Release(game_id)
+                if not leased:
+                    """ Other process moves game, this one checks back in case that one stops """
+                    has_next = True
+                    delay = self.__lease_ttl
+                elif not has_next:
+                    self.__setJobStatus(game_id, GenerationJob.DONE)
+                elif not is_running:
+                    self.__setJobStatus(game_id, GenerationJob.RUNNING)
+                    is_running = True
+            except GameConflictError:
+                """ Cached game was behind DB (it's dropped already), round is moved from latest state """
+                logger.info('Game %s was changed elsewhere, reloading it', game_id)
+                has_next = True
+            except GameRecoveryError:
+                """ Game's events don't replay (it's logged by store), job stays on until game can be loaded """
+                has_next = True
+                delay = self.__retry_interval
+            except Exception:
+                logger.exception('Generation move of game %s failed, retrying later', game_id)
+                db.session.rollback()
+                """ Cached game may be ahead of DB now """
+                game_cache.Invalidate(game_id)
+                has_next = True
+                delay = self.__retry_interval
+            finally:
+                metrics.Finish()
+                profiler.Exit()
+
+        with self.__condition:
+            del self.__active[game_id]
+        if has_next:
+            self.__enqueue(game_id, is_running, delay)
+
+    """ Calculate rest of game's round (in simulation pool, if there's one), return its frames """
+    def __simulateRound(self, game_id, game):
+        if self.__simulation_pool is not None:
+            try:
+                state, events, frames = self.__simulation_pool.SimulateRound(game_id, game)
+            except Exception:
+                """ Game is left as it was, so round can be calculated here instead """
+                logger.warning('Simulation worker failed on game %s, moving it in-process', game_id, exc_info=True)
+            else:
+                game.SetState(state, events)
+                return frames
+        return game.SimulateRound()
+
+    """ Take game's job lease (or renew it), unless other scheduler holds it; return whether it's taken """
+    def __takeLease(self, game_id) -> bool:
+        now = datetime.utcnow()
+        is_free = or_(GenerationJob.lease_owner.is_(None), GenerationJob.lease_owner == self.__owner,
+                      GenerationJob.lease_until < now)
+        taken = GenerationJob.query.filter(GenerationJob.game_id == game_id, is_free) \
+                                   .update({'lease_owner': self.__owner, 'lease_until': now + timedelta(seconds=self.__lease_ttl)},
+                                           synchronize_session=False)
+        db.session.commit()
+        return taken == 1
+
+    """ Set job's status, finished job's lease is released """
+    def __setJobStatus(self, game_id, status):
+        columns = {'status': status}
+        if status == GenerationJob.DONE:
+            columns.update(lease_owner=None, lease_until=None)
+        GenerationJob.query.filter_by(game_id=game_id, lease_owner=self.__owner).update(columns)
+        db.session.commit()
@@ -1,19 +1,42 @@
 // Interval between repeated requests in ms
-var request_interval = 300
+// (server holds status requests until game changes, so no need to wait long)
+var request_interval = 50
+
+// Version of game state client has, sent with status requests
+var game_version = $('._gamemain').data('version');
+
+// Interval between played back generations in ms
+// (server calculates whole round at once, client shows it generation by generation)
+var playback_interval = $('._gamemain').data('interval');
+
+// ETag of last status response
+var status_etag = null;
 
 /*
 	Send post request to game
 
 	@arg data - object (dict) with data to send in request
 	@arg callback - function to call after request is done,
-					must accept 1 parameter (response in parsed JSON format)
+					must accept 1 parameter (response in parsed JSON format,
+					null if response is 304 Not Modified)
+	@arg etag - (optional) ETag of previous response, sent as If-None-Match
 */
-function gamePost(data, callback){
+function gamePost(data, callback, etag){
 	var xhr = new XMLHttpRequest();
 	xhr.open("POST", location.href, true);
 	xhr.setRequestHeader('Content-type', 'application/json; charset=utf-8');
+	if (etag) {
+		xhr.setRequestHeader('If-None-Match', etag);
+	}
 	xhr.onreadystatechange = function() {
 		if (xhr.readyState == XMLHttpRequest.DONE) {
+			if (xhr.status == 304) {
+				callback(null);
+				return;
+			}
+			if (xhr.getResponseHeader('ETag')) {
+				status_etag = xhr.getResponseHeader('ETag');
+			}
 			// Response must always be JSON. If it isn't, there was an error
 			try {
 				JSON.parse(xhr.responseText);
@@ -40,21 +63,67 @@ function incCount(counts_class) {
 }
 
 /*
-	Get "numbers" (calculations) view of gameboard
+	Set cell's state on gameboard
 
-	@ret gameboard - Y*X matrix of ints representing cells' states
+	@arg cell - cell's DOM element
+	@arg state - cell's new state (0 = dead, otherwise player's number)
 */
-function calcGameboard() {
-	gameboard = [];
-	$('.gameboard .row').each(function(){
-		row = [];
-		$(this).find('.cell').each(function(){
-			row.push($(this).data('cell'));
+function setCell(cell, state) {
+	cell.className = 'cell ' + (state ? 'cell-p' + state : 'cell-dead');
+	cell.setAttribute('data-cell', state);
+}
+
+/*
+	Apply grid update from server to gameboard
+
+	@arg response - status response, with either 'changes' ([x, y, state] lists)
+					or 'frame' (whole run-length encoded grid), if any
+					('frames' are played back separately, see playFrames)
+*/
+function updateGameboard(response) {
+	var rows = $('.gameboard .row');
+	if (response.changes) {
+		response.changes.forEach(function(change){
+			setCell(rows[change[1]].children[change[0]], change[2]);
 		})
-		gameboard.push(row);
-	})
+	} else if (response.frame) {
+		var cells = $('.gameboard .cell');
+		var i = 0;
+		for (var run = 0; run < response.frame.rle.length; run += 2) {
+			for (var n = 0; n < response.frame.rle[run + 1]; n++) {
+				setCell(cells[i++], response.frame.rle[run]);
+			}
+		}
+	}
+	$('.gameboard').toggleClass('_mod-addcell', response.next_action == 'add_cell');
+}
+
 
-	return gameboard;
+/*
+	Play round's generations back one by one
+
+	@arg frames - list of [version, changes] lists, changes are [x, y, state] lists
+	@arg callback - function to call after last frame is shown
+	@arg skip_after - (optional) version after which frames are shown at once
+					  (board settled into cycle, so there's nothing new to watch)
+*/
+function playFrames(frames, callback, skip_after) {
+	if (!frames || frames.length == 0) {
+		callback();
+		return;
+	}
+	var rows = $('.gameboard .row');
+	frames[0][1].forEach(function(change){
+		setCell(rows[change[1]].children[change[0]], change[2]);
+	})
+	var next = function(){
+		playFrames(frames.slice(1), callback, skip_after);
+	};
+	if (skip_after && frames[0][0] >= skip_after) {
+		next();
+	} else {
+		setTimeout(next, playback_interval);
+	}
 }
 
 
@@ -90,27 +159,33 @@ function checkP2(){
 function updateGameStatus(){
 	post_data = {
 		'action': 'get_status',
-		'gameboard': JSON.stringify(calcGameboard())
+		'version': game_version,
+		'frames': true
 	}
 	gamePost(post_data, function(response){
-		$('._gamestatus').html(response.status);
-		$('._p1_cells').html(response.p1_cells);
-		$('._p2_cells').html(response.p2_cells);
-		if (response.gameboard) {
-			$('._gameboard_wrapper').html(response.gameboard);
-		}
-		switch (response.next_action) {
-			case 'wait':
-				setTimeout(updateGameStatus, request_interval);
-				break;
-			case 'add_cell':
-				alert('Your turn to add cells! Good luck!');
-				break;
-			case 'game_over':
-				alert('Game over! Thanks for playing!');
-				break;
+		if (response === null) {
+			setTimeout(updateGameStatus, request_interval);
+			return;
 		}
-	})
+		game_version = response.version;
+		playFrames(response.frames, function(){
+			$('._gamestatus').html(response.status);
+			$('._p1_cells').html(response.p1_cells);
+			$('._p2_cells').html(response.p2_cells);
+			updateGameboard(response);
+			switch (response.next_action) {
+				case 'wait':
+					setTimeout(updateGameStatus, request_interval);
+					break;
+				case 'add_cell':
+					alert('Your turn to add cells! Good luck!');
+					break;
+				case 'game_over':
+					alert('Game over! Thanks for playing!');
+					break;
+			}
+		}, response.cycle_period ? response.cycle_version : null);
+	}, status_etag)
 }
 
 /*
@@ -130,20 +205,13 @@ $('._gamemain').on('click', '.gameboard._mod-addcell .cell-dead', function(){
 			return false;
 		}
 		
+		game_version = response.version;
 		incCount(response.counts_class);
 		$this.removeClass('cell-dead').addClass(response.cell_class);
 		$('._gamestatus').html(response.status);
 		switch (response.next_action) {
 			case 'wait':
 				$('.gameboard._mod-addcell').removeClass('_mod-addcell');
-				if (response.send_gen_move) {
-					$.ajax({
-						type: "POST",
-						url: location.href,
-						headers: {'Content-type': 'application/json; charset=utf-8'},
-						data: JSON.stringify({'action': 'gen_move'})
-					})
-				}
 				setTimeout(updateGameStatus, request_interval);
 				break;
 		}
@@ -0,0 +1,207 @@
+"""
+    Games storage module: loading games from DB through cache and saving them back
+    Game's state is stored as snapshot plus log of events after it
+"""
+import logging
+from flask import json
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+from game import app, db, game_cache, game_events, lobby_games_count, metrics, user_names
+from game.cache import CachedGame
+from game.game import GameOfLife, GameState, getGame
+from game.grid import PackedGrid
+from game.models import Game, GameEvent, GameStateEntry, GenerationJob, User
+
+logger = logging.getLogger(__name__)
+
+
+""" Game was written elsewhere (e.g. by other process) since cached copy of it was loaded """
+class GameConflictError(Exception):
+    pass
+
+
+""" Game's events can't be replayed on its snapshot (e.g. some are missing), so its state is unknown """
+class GameRecoveryError(Exception):
+    pass
+
+
+"""
+    Get live game from cache, load it from DB on cache miss
+    Game that can't be recovered from its events is not cached (it would be saved on top of
+    wrong state and version), GameRecoveryError is raised instead
+"""
+def getCachedGame(game_id) -> CachedGame:
+    try:
+        game_id = int(game_id)
+    except:
+        return None
+    
+    cached = game_cache.Get(game_id)
+    if cached is None:
+        entries = db.session.query(Game, GameStateEntry).join(GameStateEntry, GameStateEntry.game_id == Game.id) \
+                                                        .options(joinedload(Game.first_player), joinedload(Game.second_player)) \
+                                                        .filter(Game.id == game_id).first()
+        if entries == None:
+            return None
+        game_db, state_db = entries
+        """ Players' names come along, so game's requests don't have to query them """
+        for player in (game_db.first_player, game_db.second_player):
+            if player is not None:
+                user_names.Put(player.id, player.username)
+        with metrics.Phase('deserialize'):
+            game = getGameFromEntry(game_db, state_db)
+            snapshot_version = game.Version
+            events = GameEvent.query.filter(GameEvent.game_id == game_id, GameEvent.version > snapshot_version) \
+                                    .order_by(GameEvent.id).all()
+            if events and not game.Replay([(event.kind, event.version, json.loads(event.data)) for event in events]):
+                logger.error('Game %s could not be recovered from its events: %s', game_id, game.error_message)
+                raise GameRecoveryError('Game {} could not be recovered: {}'.format(game_id, game.error_message))
+        cached = CachedGame(game_db.id, game, game_db.first_player_id, game_db.second_player_id, game_db.status)
+        cached.stored_state = {'grid': state_db.grid, 'params': state_db.params}
+        cached.snapshot_version = snapshot_version
+        cached.stored_version = game_db.version
+        cached = game_cache.Put(cached)
+    return cached
+
+
+""" User's name, from cache if it's there (None if there's no such user) """
+def getUserName(user_id: int) -> str:
+    if user_id is None:
+        return None
+    name = user_names.Get(user_id)
+    if name is None:
+        name = db.session.query(User.username).filter(User.id == user_id).scalar()
+        if name is not None:
+            user_names.Put(user_id, name)
+    return name
+
+
+@event.listens_for(User, 'after_update')
+def invalidateUserName(mapper, connection, user):
+    user_names.Invalidate(user.id)
+
+
+""" Create DB entries of new game """
+def addGame(game: GameOfLife, first_player_id: int) -> Game:
+    game_db = Game(first_player_id=first_player_id, version=game.Version, settings=game._GameOfLife__settings.ToJSON())
+    db.session.add(game_db)
+    db.session.flush()
+    db.session.add(GameStateEntry(game_id=game_db.id, **getStateColumns(game._GameOfLife__state)))
+    db.session.commit()
+    lobby_games_count.Invalidate()
+    return game_db
+
+
+"""
+    Page of games matching condition, newest first, with their players loaded along
+    Pages are keyed by id (games older than given one), so deep pages cost the same as first one
+    Return games and id to get next page with (None if it's the last page)
+"""
+def getGamesPage(condition, before: int=None, page_size: int=20) -> tuple:
+    query = Game.query.options(joinedload(Game.first_player), joinedload(Game.second_player)).filter(condition)
+    if before is not None:
+        query = query.filter(Game.id < before)
+    games = query.order_by(Game.id.desc()).limit(page_size + 1).all()
+    if len(games) > page_size:
+        return games[:page_size], games[page_size - 1].id
+    return games, None
+
+
+"""
+    Write cached game's changes through to DB: its new events, and state snapshot
+    once enough events were logged since last one (or if game is over)
+    Only snapshot columns that changed since last write are written
+    Write is compare-and-swap on game's version: if game was written elsewhere since
+    it was loaded, nothing is written, cached game is dropped and GameConflictError is raised
+    (cached game is dropped on any other failed write too, error is raised further)
+    Game entering generations-step phase gets its pending generation job in same write
+"""
+def saveGameState(cached: CachedGame):
+    state = cached.game._GameOfLife__state
+    events = cached.game.PopEvents()
+    game_columns = {'version': state.version}
+    if state.phase == -1 and cached.status != 2:
+        game_columns['status'] = 2
+    try:
+        if Game.query.filter_by(id=cached.id, version=cached.stored_version).update(game_columns) != 1:
+            raise GameConflictError('Game {} was changed since version {}'.format(cached.id, cached.stored_version))
+        db.session.add_all([GameEvent(game_id=cached.id, version=version, kind=kind, data=json.dumps(data))
+                            for kind, version, data in events])
+        
+        """ State changed without events can't be replayed, so it's always snapshotted """
+        changed = {}
+        if not events or state.phase == -1 or state.version - cached.snapshot_version >= app.config['SNAPSHOT_INTERVAL']:
+            with metrics.Phase('serialize'):
+                columns = getStateColumns(state)
+            changed = {column: value for column, value in columns.items() if cached.stored_state.get(column) != value}
+            if changed:
+                GameStateEntry.query.filter_by(game_id=cached.id).update(changed)
+        
+        """ Game's job is written along with its generations-step phase, so no crash can leave game in it without job """
+        if state.phase == 1:
+            job = GenerationJob.query.filter_by(game_id=cached.id).first()
+            if job is None:
+                db.session.add(GenerationJob(game_id=cached.id, status=GenerationJob.PENDING))
+            elif job.status == GenerationJob.DONE:
+                job.status = GenerationJob.PENDING
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        """
+            Cached game is behind DB (conflict) or ahead of it without its events (failed write),
+            either way it's dropped, its own changes are lost (see changeGame for reapplying them)
+        """
+        game_cache.Invalidate(cached.id)
+        raise
+    cached.stored_version = state.version
+    cached.status = game_columns.get('status', cached.status)
+    if changed:
+        cached.stored_state.update(changed)
+        cached.snapshot_version = state.version
+    game_cache.Touch(cached)
+    game_events.Notify(cached.id)
+
+
+"""
+    Apply change to cached game and save it, change is function of game returning whether it changed game
+    If game was written elsewhere meanwhile, change is merged into it: applied again to game's latest
+    state (reloaded from DB), so it's checked against that state; after retries more conflicts
+    GameConflictError is raised
+    Return cached game change was applied to last, change's result and game's version right after it
+"""
+def changeGame(cached: CachedGame, change, retries: int=3) -> tuple:
+    for attempt in range(retries + 1):
+        with cached.lock:
+            result = change(cached.game)
+            version = cached.game.Version
+            if not result:
+                return cached, result, version
+            try:
+                saveGameState(cached)
+                return cached, result, version
+            except GameConflictError:
+                if attempt == retries:
+                    raise
+                logger.info('Game %s was changed elsewhere, applying change to its latest state', cached.id)
+        reloaded = getCachedGame(cached.id)
+        if reloaded is None:
+            return cached, False, version
+        cached = reloaded
+
+
+""" State as game state entry's columns: packed grid and JSON of other params """
+def getStateColumns(game_state: GameState) -> dict:
+    params = game_state.ToDict()
+    grid = params.pop('grid')
+    return {'grid': PackedGrid.FromRows(grid).ToBytes(), 'params': json.dumps(params)}
+
+
+def getGameFromEntry(game_entry: Game, state_entry: GameStateEntry) -> GameOfLife:
+    if not isinstance(game_entry, Game) or not isinstance(state_entry, GameStateEntry):
+        return None
+    
+    state_params = json.loads(state_entry.params)
+    state_params['grid'] = PackedGrid.FromBytes(state_entry.grid).ToRows()
+    """ States stored in other layout are validated """
+    trusted = state_entry.schema_version == GameStateEntry.SCHEMA_VERSION
+    return getGame(json.loads(game_entry.settings), state_params, trusted)
@@ -1,5 +1,30 @@
+import itertools
+import json
+import os
+import random
+import signal
+import threading
+import time
 import unittest
-from game import GameOfLife, GameSettings, GameState
+import unittest.mock
+from datetime import datetime, timedelta
+from flask_migrate import upgrade
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Query
+from game import GameOfLife, GameSettings, GameState, app, db, game_cache
+from game.bench import compareResults, runBenchmarks, seededGrid
+from game.cache import CachedGame, CachedValue, GameCache, GridHistory, UserNameCache
+from game.events import GameEvents
+from game.game import getGame
+from game.grid import PackedGrid, decodeRLE, encodeRLE, gridChanges
+from game.engines import ActivityEngine, AdaptiveEngine, NumpyEngine, SparseEngine
+from game.hashlife import HashlifeEngine
+from game.loadtest import LoadStats, percentile
+from game.metrics import Histogram, Metrics, SamplingProfiler
+from game.models import Game, GameEvent, GenerationJob, User
+from game.scheduler import GenerationScheduler
+from game.store import GameConflictError, GameRecoveryError, changeGame, getCachedGame, saveGameState
+from game.workers import SimulationPool
 
 
 class GameLogicTestCase(unittest.TestCase):
@@ -151,6 +176,203 @@ class GameLogicTestCase(unittest.TestCase):
         assert self.game._GameOfLife__state.grid == grid
 
     
+    def test_Version(self):
+        self.__setManualGrid()
+        assert self.game.Version == 0
+        self.game.Move()
+        assert self.game.Version == 1
+        self.game.Move()
+        self.game.Move()
+        assert self.game.Version == 2
+        self.game._GameOfLife__state.players_turn_queue = [1, 2]
+        self.game.AddCell(0, 0, 2)
+        self.game.AddCell(1, 4, 1)
+        assert self.game.Version == 3
+    
+    """ Counts are kept up to date by moves and added cells, and only counted for states stored without them """
+    def test_Counts(self):
+        assert self.game.counts == [0, 0, 0]
+        self.__setManualGrid()
+        for _ in range(3):
+            self.game.Move()
+            counts = self.game.counts[:]
+            self.game._GameOfLife__setCounts()
+            assert self.game.counts == counts
+        
+        state = GameState()
+        for param, value in json.loads(self.game._GameOfLife__state.ToJSON()).items():
+            state.__setattr__(param, value)
+        state.counts = [0, 100, 100]
+        assert GameOfLife(settings=self.__getSettings(), state=state).counts == [0, 100, 100]
+        state.counts = []
+        assert GameOfLife(settings=self.__getSettings(), state=state).counts == counts
+    
+    """ Round simulated at once must end same as moved generation by generation, with its every generation in frames """
+    def test_SimulateRound(self):
+        self.__setManualGrid()
+        reference = GameOfLife(settings=self.__getSettings(),
+                               state=GameState.FromStorage(json.loads(self.game._GameOfLife__state.ToJSON())))
+        grid = [row[:] for row in self.game.Grid]
+        frames = self.game.SimulateRound()
+        assert [version for version, _ in frames] == [1, 2]
+        for version, changes in frames:
+            reference.Move()
+            assert reference.Version == version
+            for x, y, cell in changes:
+                grid[y][x] = cell
+            assert grid == reference.Grid
+        assert self.game._GameOfLife__state.ToDict() == reference._GameOfLife__state.ToDict()
+        assert self.game.SimulateRound() == []
+    
+    """ Rest of round is looked up once board repeats, with same result as if it was calculated """
+    def test_Cycle(self):
+        settings = GameSettings(generations_per_round=30)
+        settings.grid_size = (10, 10)
+        """ Cycle period => board (glider doesn't come back within round on this grid) """
+        boards = {
+            1: [(1, 1), (2, 1), (1, 2), (2, 2)],
+            2: [(5, 1), (5, 2), (5, 3)],
+            0: [(1, 0), (2, 1), (0, 2), (1, 2), (2, 2)],
+        }
+        """ Engine keeps round's board to itself, frames come from it (or from grids, if engine doesn't track changes) """
+        engines = (lambda: None, NumpyEngine, SparseEngine, lambda: ActivityEngine(tile_size=4))
+        for (period, cells), engine in itertools.product(boards.items(), engines):
+            games = []
+            for game_engine in (engine(), None):
+                game = GameOfLife(settings=settings, engine=game_engine, seed=1)
+                for x, y in cells:
+                    game.Grid[y][x] = 1
+                game._GameOfLife__setCounts()
+                game._GameOfLife__state.phase = 1
+                games.append(game)
+            grid = [row[:] for row in games[0].Grid]
+            frames = games[0].SimulateRound()
+            while games[1].Phase == 1:
+                games[1].Move()
+            assert len(frames) == 30
+            assert games[0].Cycle[0] == period
+            for _, changes in frames:
+                for x, y, cell in changes:
+                    grid[y][x] = cell
+            assert grid == games[1].Grid
+            state = games[0]._GameOfLife__state.ToDict()
+            del state['cycle_period'], state['cycle_version']
+            reference = games[1]._GameOfLife__state.ToDict()
+            del reference['cycle_period'], reference['cycle_version']
+            assert state == reference
+            events = games[0].PopEvents()
+            assert [event for event in events if event[0] != 'cycle'] == games[1].PopEvents()
+            assert [event for event in events if event[0] == 'cycle'] == ([('cycle', games[0].Cycle[1], [period])] if period else [])
+    
+    """ Boards with same hash are only taken for cycle once their cells turn out to be same """
+    def test_CycleHashCollision(self):
+        settings = GameSettings(generations_per_round=30)
+        settings.grid_size = (10, 10)
+        games = []
+        for _ in range(3):
+            game = GameOfLife(settings=settings, seed=1)
+            for x, y in [(1, 0), (2, 1), (0, 2), (1, 2), (2, 2), (6, 5), (6, 6), (6, 7)]:
+                game.Grid[y][x] = 1
+            game._GameOfLife__setCounts()
+            game._GameOfLife__state.phase = 1
+            games.append(game)
+        with unittest.mock.patch.object(GameOfLife, '_GameOfLife__boardHash', lambda game: 0):
+            frames = games[0].SimulateRound()
+        assert frames == games[1].SimulateRound()
+        assert games[0].Cycle == games[1].Cycle
+        while games[2].Phase == 1:
+            games[2].Move()
+        state = games[0]._GameOfLife__state.ToDict()
+        del state['cycle_period'], state['cycle_version']
+        reference = games[2]._GameOfLife__state.ToDict()
+        del reference['cycle_period'], reference['cycle_version']
+        assert state == reference
+    
+    """ Games with same seed make same random choices """
+    def test_Seed(self):
+        settings = GameSettings(generations_per_round=1, rounds_number=30, new_cells_per_round=5)
+        settings.players_number = 5
+        queues = []
+        for seed in (7, 7, 8):
+            game = GameOfLife(settings=settings, seed=seed)
+            state = game._GameOfLife__state
+            queues.append([state.players_turn_queue[:]])
+            for _ in range(10):
+                state.phase = 1
+                game.Move()
+                queues[-1].append(state.players_turn_queue[:])
+        assert queues[0] == queues[1]
+        assert queues[0] != queues[2]
+    
+    """ Game rebuilt from state snapshot and events after it must be same as original one """
+    def test_Replay(self):
+        self.game._GameOfLife__settings.rounds_number = 3
+        self.__setManualGrid()
+        self.game.Move()
+        snapshot = self.game._GameOfLife__state.ToJSON()
+        self.game.PopEvents()
+        
+        self.game.Move()
+        for player in self.game._GameOfLife__state.players_turn_queue[:]:
+            cells = [(x, y) for y in range(6) for x in range(10) if self.game.Grid[y][x] == 0][:5]
+            for x, y in cells:
+                assert self.game.AddCell(x, y, player) == True
+        while self.game.Phase == 1:
+            self.game.Move()
+        events = self.game.PopEvents()
+        assert [kind for kind, _, _ in events].count('round') == 2
+        
+        game = GameOfLife(settings=self.game._GameOfLife__settings,
+                          state=GameState.FromStorage(json.loads(snapshot)))
+        assert game.Replay(events) == True
+        assert game._GameOfLife__state.ToDict() == self.game._GameOfLife__state.ToDict()
+        assert game.PopEvents() == []
+        
+        game = GameOfLife(settings=self.game._GameOfLife__settings,
+                          state=GameState.FromStorage(json.loads(snapshot)))
+        assert game.Replay(events[1:]) == False
+        
+        """ Rounds simulated at once replay to same state, cycle they settled into (or none) included """
+        settings = GameSettings(generations_per_round=30, rounds_number=3, new_cells_per_round=5)
+        settings.grid_size = (10, 10)
+        game = GameOfLife(settings=settings, seed=1)
+        for x, y in [(5, 1), (5, 2), (5, 3)]:
+            game.Grid[y][x] = 1
+        game._GameOfLife__setCounts()
+        game._GameOfLife__state.phase = 1
+        snapshots = []
+        for _ in range(2):
+            snapshots.append(game._GameOfLife__state.ToJSON())
+            game.PopEvents()
+            for player in game._GameOfLife__state.players_turn_queue[:]:
+                cells = [(x, y) for y in range(6, 10) for x in range(10) if game.Grid[y][x] == 0][:5]
+                for x, y in cells:
+                    game.AddCell(x, y, player)
+            game.SimulateRound()
+            assert game.Cycle[0] != 0 or len(snapshots) == 2
+            replayed = GameOfLife(settings=settings, state=GameState.FromStorage(json.loads(snapshots[-1])))
+            assert replayed.Replay(game.PopEvents()) == True
+            assert replayed._GameOfLife__state.ToDict() == game._GameOfLife__state.ToDict()
+    
+    """ All players' moves in one pass must end in same grid as moves one player at a time """
+    def test_GenerationMove(self):
+        rand = random.Random(5)
+        for players_number in range(1, 6):
+            settings = GameSettings(generations_per_round=10)
+            settings.grid_size = (15, 12)
+            settings.players_number = players_number
+            for _ in range(5):
+                game = GameOfLife(settings=settings)
+                state = game._GameOfLife__state
+                state.grid = [[rand.choice(range(players_number + 1)) for _ in range(15)] for _ in range(12)]
+                state.phase = 1
+                grid = [row[:] for row in state.grid]
+                for state.cur_player_index in range(players_number):
+                    game._GameOfLife__playerMove()
+                expected, state.grid = state.grid, grid
+                game._GameOfLife__generationMove()
+                assert state.grid == expected
+    
     def test_GameProcess(self):
         self.__setManualGrid()
 
@@ -231,6 +453,8 @@ class GameLogicTestCase(unittest.TestCase):
         self.game._GameOfLife__state.players_turn_queue = [1, 2]
         self.game._GameOfLife__state.cur_player_index = 0
         self.game._GameOfLife__state.phase = 1
+        """ Grid is replaced directly, so counts have to be redone """
+        self.game._GameOfLife__setCounts()
         self.grid_size = (10, 6)
     
     def __getStartGrid(self):
@@ -254,5 +478,813 @@ class GameLogicTestCase(unittest.TestCase):
         ]
 
 
+
+class EnginesTestCase(unittest.TestCase):
+    """ Engines must give same grids as built-in calculation """
+    def test_NumpyEngine(self):
+        self.__assertSameAsBuiltin(NumpyEngine)
+    
+    def test_SparseEngine(self):
+        self.__assertSameAsBuiltin(SparseEngine)
+    
+    def test_ActivityEngine(self):
+        self.__assertSameAsBuiltin(ActivityEngine)
+        """ Only dirty tiles are stepped (small tiles, so tiles across torus edges are hit too) """
+        self.__assertSameAsBuiltin(lambda: ActivityEngine(tile_size=4, full_step_share=1.0))
+        engine = ActivityEngine(tile_size=4, full_step_share=1.0)
+        grid = [[0] * 16 for _ in range(16)]
+        grid[0][14:16] = grid[1][14:16] = [1, 1]
+        engine.Load(grid)
+        engine.Generation([1])
+        assert engine.Changes() == []
+        engine.SetCell(8, 8, 1)
+        engine.Generation([1])
+        assert engine.Changes() == [[8, 8, 0]]
+        assert engine.Grid() == grid
+        
+        """ Board's hash is kept up with changed cells only, it's same as hash of board loaded anew """
+        rand = random.Random(7)
+        for full_step_share in (0.0, 1.0):
+            engine = ActivityEngine(tile_size=4, full_step_share=full_step_share)
+            engine.Load([[rand.choice(range(6)) for _ in range(17)] for _ in range(11)])
+            engine.SetCell(3, 4, 5)
+            for _ in range(8):
+                engine.Generation([5, 4, 3, 2, 1])
+                loaded = ActivityEngine()
+                loaded.Load(engine.Grid())
+                assert engine.Fingerprint() == loaded.Fingerprint()
+    
+    def test_AdaptiveEngine(self):
+        self.__assertSameAsBuiltin(AdaptiveEngine)
+        engine = AdaptiveEngine()
+        grid = [[0] * 40 for _ in range(40)]
+        grid[0][:3] = [1, 1, 1]
+        engine.Load(grid)
+        assert isinstance(engine.Current, SparseEngine)
+        engine.Load([[1] * 40 for _ in range(40)])
+        assert isinstance(engine.Current, ActivityEngine)
+        engine.Generation([1])
+        assert isinstance(engine.Current, SparseEngine)
+        assert engine.Grid() == [[0] * 40 for _ in range(40)]
+        """ Few percent of large board is already too many cells for sparse engine """
+        engine.Load(seededGrid(200, 200, 2, 0.04, 0))
+        assert isinstance(engine.Current, ActivityEngine)
+    
+    def test_HashlifeEngine(self):
+        self.__assertSameAsBuiltin(HashlifeEngine)
+        """ Caches over their size are dropped between jumps only, so jumps come out same as with big caches """
+        rand = random.Random(3)
+        grid = [[rand.choice((0, 0, 1, 2)) for _ in range(30)] for _ in range(20)]
+        engines = [HashlifeEngine(), HashlifeEngine(cache_size=50)]
+        for engine in engines:
+            engine.Load(grid)
+            engine.Advance([1, 2], 50)
+            engine.Generation([1, 2])
+        assert engines[0].Grid() == engines[1].Grid()
+        assert engines[1].CacheSize < engines[0].CacheSize
+    
+    """ Whole round jump must end in same state as generation-by-generation moves """
+    def test_Advance(self):
+        rand = random.Random(7)
+        settings = GameSettings(generations_per_round=10)
+        settings.grid_size = (23, 13)
+        settings.players_number = 3
+        grid = [[rand.choice((0, 0, 1, 2, 3)) for _ in range(23)] for _ in range(13)]
+        for engine in (None, NumpyEngine(), HashlifeEngine(cache_size=1000)):
+            reference = self.__getGame(settings, grid)
+            game = self.__getGame(settings, grid, engine)
+            for _ in range(9):
+                reference.Move()
+            assert game.Advance(9) == True
+            assert game._GameOfLife__state.grid == reference._GameOfLife__state.grid
+            assert game._GameOfLife__state.cur_round_generation == 10
+            assert game.Advance(5) == True
+            assert game._GameOfLife__state.cur_round == 2
+            assert game._GameOfLife__state.phase == 0
+            assert game.Advance(1) == False
+    
+    def __assertSameAsBuiltin(self, engine_class):
+        rand = random.Random(42)
+        for players_number in range(1, 6):
+            settings = GameSettings(generations_per_round=10)
+            settings.grid_size = (17, 11)
+            settings.players_number = players_number
+            grid = [[rand.choice(range(players_number + 1)) for _ in range(17)] for _ in range(11)]
+            reference = self.__getGame(settings, grid)
+            game = self.__getGame(settings, grid, engine_class())
+            for _ in range(8):
+                grid = reference._GameOfLife__state.grid
+                reference.Move()
+                game.Move()
+                assert game._GameOfLife__state.grid == reference._GameOfLife__state.grid
+                assert game.counts == reference.counts
+                """ Engines tracking changes must report same cells as grids comparison """
+                changes = game._GameOfLife__engine.Changes()
+                if changes is not None:
+                    assert sorted(changes) == sorted(gridChanges(grid, reference._GameOfLife__state.grid))
+    
+    def __getGame(self, settings, grid, engine=None):
+        game = GameOfLife(settings=settings, engine=engine)
+        game._GameOfLife__state.grid = [row[:] for row in grid]
+        game._GameOfLife__setCounts()
+        game._GameOfLife__state.players_turn_queue = list(range(settings.players_number, 0, -1))
+        game._GameOfLife__state.phase = 1
+        return game
+
+
+
+class PackedGridTestCase(unittest.TestCase):
+    def test_Rows(self):
+        rows = [[(x * 7 + y * 3) % 6 for x in range(13)] for y in range(11)]
+        grid = PackedGrid.FromRows(rows)
+        assert len(grid.Buffer()) == (13 * 11 + 7) // 8 * 3
+        assert grid.ToRows() == rows
+        for y in range(11):
+            for x in range(13):
+                assert grid[x, y] == rows[y][x]
+    
+    def test_SetCell(self):
+        grid = PackedGrid(10, 10)
+        grid[3, 4] = 5
+        grid[4, 4] = 7
+        grid[3, 4] = 2
+        assert grid[3, 4] == 2
+        assert grid[4, 4] == 7
+        assert grid[2, 4] == 0
+        self.assertRaises(IndexError, grid.__getitem__, (10, 0))
+        self.assertRaises(ValueError, grid.__setitem__, (0, 0), 8)
+    
+    def test_Encoding(self):
+        rows = [[(x + y) % 4 for x in range(30)] for y in range(20)]
+        grid = PackedGrid.FromRows(rows)
+        assert PackedGrid.FromBytes(grid.ToBytes()) == grid
+        assert PackedGrid.FromBase64(grid.ToBase64()).ToRows() == rows
+        
+        """ Buffer is not a copy """
+        grid.Buffer()[0] = 0
+        assert grid[0, 0] == 0 and grid[1, 0] == 0
+    
+    def test_GameState(self):
+        game = GameOfLife(settings=GameSettings())
+        game.AddCell(4, 5, game._GameOfLife__state.players_turn_queue[0])
+        state_json = game._GameOfLife__state.ToJSON()
+        state = GameState()
+        for param, value in json.loads(state_json).items():
+            state.__setattr__(param, value)
+        assert state.grid == game._GameOfLife__state.grid
+        assert len(state_json) < len(json.dumps(state.grid))
+    
+    """ Stored state is loaded as is, other input is validated """
+    def test_FromStorage(self):
+        game = GameOfLife(settings=GameSettings())
+        game.AddCell(4, 5, game._GameOfLife__state.players_turn_queue[0])
+        params = json.loads(game._GameOfLife__state.ToJSON())
+        state = GameState.FromStorage(params)
+        assert state.ToDict() == game._GameOfLife__state.ToDict()
+        
+        params['grid'] = [[0, -1], [0, 0]]
+        params['phase'] = 5
+        state = GameState.FromStorage(params, trusted=False)
+        assert state.grid == []
+        assert state.phase == 0
+        assert state.cur_winner == game._GameOfLife__state.cur_winner
+
+
+
+class GameCacheTestCase(unittest.TestCase):
+    def test_Eviction(self):
+        cache = GameCache(size=2, ttl=60)
+        for game_id in (1, 2):
+            cache.Put(CachedGame(game_id, GameOfLife(), 1, None, 0))
+        assert cache.Get(1).id == 1
+        cache.Put(CachedGame(3, GameOfLife(), 1, None, 0))
+        assert cache.Get(2) is None
+        assert cache.Get(1) is not None and cache.Get(3) is not None
+        
+        cache = GameCache(size=2, ttl=0)
+        cache.Put(CachedGame(1, GameOfLife(), 1, None, 0))
+        assert cache.Get(1) is None
+    
+    def test_History(self):
+        cache = GameCache()
+        game = GameOfLife()
+        entry = cache.Put(CachedGame(1, game, 1, None, 0))
+        game.AddCell(0, 0, game._GameOfLife__state.players_turn_queue[0])
+        cache.Touch(entry)
+        cache.Touch(entry)
+        assert entry.history.ChangesSince(0) == [[0, 0, game._GameOfLife__state.players_turn_queue[0]]]
+        assert entry.history.ChangesSince(1) is None
+
+
+    def test_Changes(self):
+        old = [[0, 1, 0], [2, 2, 0]]
+        new = [[0, 1, 1], [0, 2, 0]]
+        assert gridChanges(old, new) == [[2, 0, 1], [0, 1, 0]]
+        assert gridChanges(new, new) == []
+    
+    def test_RLE(self):
+        grid = [[0, 0, 1, 1], [1, 0, 0, 0], [0, 0, 0, 2]]
+        assert encodeRLE(grid) == [0, 2, 1, 3, 0, 6, 2, 1]
+        assert decodeRLE(encodeRLE(grid), 4) == grid
+    
+    def test_GridHistory(self):
+        history = GridHistory([[0, 0], [0, 0]], size=2)
+        assert history.ChangesSince(0) is None
+        history.Record(1, [[1, 0], [0, 0]])
+        history.Record(2, [[1, 2], [0, 0]])
+        assert history.ChangesSince(2) is None
+        assert sorted(history.ChangesSince(0)) == [[0, 0, 1], [1, 0, 2]]
+        history.Record(3, [[0, 2], [0, 0]])
+        assert history.ChangesSince(0) is None
+        assert sorted(history.ChangesSince(1)) == [[0, 0, 0], [1, 0, 2]]
+        
+        history.RecordFrames([(4, [[0, 1, 1]]), (5, [[0, 1, 0]])], [[0, 2], [0, 0]])
+        assert history.FramesSince(3) == [[4, [[0, 1, 1]]], [5, [[0, 1, 0]]]]
+        assert history.FramesSince(4) == [[5, [[0, 1, 0]]]]
+        assert history.ChangesSince(3) == [[0, 1, 0]]
+        assert history.FramesSince(2) is None
+
+
+
+class CachedValueTestCase(unittest.TestCase):
+    def test_Get(self):
+        loads = []
+        def load():
+            loads.append(1)
+            return len(loads)
+        value = CachedValue(ttl=60)
+        assert value.Get(load) == 1
+        assert value.Get(load) == 1
+        value.Invalidate()
+        assert value.Get(load) == 2
+        expired = CachedValue(ttl=-1)
+        assert expired.Get(load) == 3
+        assert expired.Get(load) == 4
+
+
+
+class UserNameCacheTestCase(unittest.TestCase):
+    def test_Names(self):
+        names = UserNameCache(size=2)
+        names.Put(1, 'alice')
+        names.Put(2, 'bob')
+        assert names.Get(1) == 'alice'
+        names.Put(3, 'carol')
+        """ Least recently used one is evicted """
+        assert names.Get(2) is None
+        assert names.Get(1) == 'alice'
+        names.Invalidate(1)
+        assert names.Get(1) is None
+        assert names.Get(3) == 'carol'
+
+
+
+class GameEventsTestCase(unittest.TestCase):
+    def test_Wait(self):
+        events = GameEvents()
+        changes = []
+        assert events.Wait(1, lambda: len(changes) > 0, 0.01) == False
+        
+        def change():
+            changes.append(1)
+            events.Notify(1)
+        timer = threading.Timer(0.05, change)
+        timer.start()
+        assert events.Wait(1, lambda: len(changes) > 0, 5) == True
+        timer.join()
+        """ Games nobody waits for aren't kept """
+        events.Notify(2)
+        assert events._GameEvents__conditions == {}
+
+
+class SimulationPoolTestCase(unittest.TestCase):
+    """ Moves in worker processes must end in same state as in-process ones """
+    def test_Move(self):
+        rand = random.Random(3)
+        settings = {'generations_per_round': 10, 'rounds_number': 3, 'new_cells_per_round': 10}
+        grid = [[rand.choice((0, 0, 1, 2)) for _ in range(20)] for _ in range(15)]
+        state = {'grid': grid, 'phase': 1, 'players_turn_queue': [2, 1]}
+        reference = getGame(settings, json.loads(json.dumps(state)))
+        game = getGame(settings, json.loads(json.dumps(state)))
+        pool = SimulationPool(2)
+        try:
+            for _ in range(5):
+                reference.Move()
+                game.SetState(*pool.Move(1, game))
+                assert game.Grid == reference.Grid
+                assert game.Version == reference.Version
+            """ Game changed outside of worker must be resent """
+            x, y = next((x, y) for y in range(15) for x in range(20) if game.Grid[y][x] == 0)
+            for changed in (reference, game):
+                changed._GameOfLife__state.phase = 0
+                changed._GameOfLife__state.cur_player_index = 0
+                assert changed.AddCell(x, y, 2) == True
+            reference._GameOfLife__state.phase = game._GameOfLife__state.phase = 1
+            reference.Move()
+            game.SetState(*pool.Move(1, game))
+            assert game.Grid == reference.Grid
+            assert game.PopEvents() == reference.PopEvents()
+            assert sum(stats['requests'] for stats in pool.Stats()) == 6
+            
+            frames = reference.SimulateRound()
+            state, events, pool_frames = pool.SimulateRound(1, game)
+            game.SetState(state, events)
+            assert pool_frames == frames
+            assert game.Grid == reference.Grid
+        finally:
+            pool.Release(1)
+            pool.Stop()
+
+    """ Killed worker must not block requests: it's replaced and game is resent to new one """
+    def test_WorkerDied(self):
+        settings = {'generations_per_round': 10, 'rounds_number': 3, 'new_cells_per_round': 10}
+        state = {'grid': [[0, 1, 0, 0], [0, 1, 0, 0], [0, 1, 0, 0], [0, 0, 0, 0]], 'phase': 1, 'players_turn_queue': [1, 2]}
+        reference = getGame(settings, json.loads(json.dumps(state)))
+        game = getGame(settings, json.loads(json.dumps(state)))
+        pool = SimulationPool(1, timeout=30)
+        try:
+            reference.Move()
+            game.SetState(*pool.Move(1, game))
+            pid = pool.Stats()[0]['pid']
+            os.kill(pid, signal.SIGKILL)
+            deadline = time.monotonic() + 5
+            while pool.Stats()[0]['alive'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert pool.Stats()[0]['alive'] == False
+            
+            reference.Move()
+            game.SetState(*pool.Move(1, game))
+            assert game.Grid == reference.Grid
+            assert pool.Stats()[0]['pid'] != pid
+            assert pool.Stats()[0]['queue_depth'] == 0
+        finally:
+            pool.Release(1)
+            pool.Stop()
+
+
+
+""" Base of tests going through app's routes (test client) and DB """
+class AppTestCase(unittest.TestCase):
+    users = itertools.count()
+
+    @classmethod
+    def setUpClass(cls):
+        """ Temporary database is set up by conftest.py (run tests with pytest), app's own one is never touched """
+        if 'gol-test-' not in app.config['SQLALCHEMY_DATABASE_URI']:
+            raise unittest.SkipTest('no test database')
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['LONG_POLL_TIMEOUT'] = 0.2
+        with app.app_context():
+            upgrade(directory=os.path.join(os.path.dirname(app.root_path), 'migrations'))
+
+    """ Test client of newly registered and logged in user """
+    def login(self, name: str):
+        client = app.test_client()
+        username = '{}{}'.format(name, next(self.users))
+        client.post('/register', data={'username': username, 'password': 'pw', 'confirm_password': 'pw'})
+        client.post('/login', data={'username': username, 'password': 'pw'})
+        client.username = username
+        return client
+
+    """ Id of new game created by client (and joined by second one, if given) """
+    def newGame(self, client, second=None, generations: int=5, rounds: int=2, cells: int=5) -> int:
+        response = client.post('/new', data={'generations_per_round': generations, 'rounds_number': rounds,
+                                             'new_cells_per_round': cells})
+        game_id = int(response.headers['Location'].rsplit('/', 1)[1])
+        if second is not None:
+            assert second.get('/game/{}'.format(game_id)).status_code == 200
+        return game_id
+
+    def post(self, client, game_id: int, data: dict, **kwargs):
+        return client.post('/game/{}'.format(game_id), json=data, **kwargs)
+
+    """ Player whose turn it is to add cells """
+    @staticmethod
+    def turn(cached) -> int:
+        state = cached.game._GameOfLife__state
+        return state.players_turn_queue[state.cur_player_index]
+
+
+
+class RoutesTestCase(AppTestCase):
+    """ Spectators learn about second player (long-polling until then), but can't add cells """
+    def test_Spectator(self):
+        first, second, spectator = self.login('p1-'), self.login('p2-'), self.login('s-')
+        game_id = self.newGame(first)
+        start = time.monotonic()
+        response = self.post(spectator, game_id, {'action': 'check_p2'}).get_json()
+        assert response == {'p2_ingame': False}
+        assert time.monotonic() - start >= app.config['LONG_POLL_TIMEOUT']
+        
+        second.get('/game/{}'.format(game_id))
+        assert spectator.get('/game/{}'.format(game_id)).status_code == 200
+        response = self.post(spectator, game_id, {'action': 'check_p2'}).get_json()
+        assert response == {'p2_ingame': True, 'p2_name': second.username}
+        response = self.post(spectator, game_id, {'action': 'add_cell', 'cell_x': 0, 'cell_y': 0}).get_json()
+        assert response['error'] == True
+        response = self.post(spectator, game_id, {'action': 'get_status'}).get_json()
+        assert response['next_action'] == 'wait'
+
+    """ Metrics are only shown to operators """
+    def test_MetricsOperatorsOnly(self):
+        client = self.login('op-')
+        assert client.get('/metrics').status_code == 403
+        assert client.get('/metrics/profile/1').status_code == 403
+        with app.app_context():
+            user_id = User.query.filter_by(username=client.username).first().id
+        app.config['OPERATOR_IDS'] = [user_id]
+        try:
+            response = client.get('/metrics')
+            assert response.status_code == 200 and 'timings' in response.get_json()
+            assert client.get('/metrics/simulation').status_code == 200
+        finally:
+            app.config['OPERATOR_IDS'] = []
+
+    """ Status has cells changed since client's version; whole grid, run-length encoded, if it's unknown or too old """
+    def test_GridUpdate(self):
+        first, second = self.login('p1-'), self.login('p2-')
+        game_id = self.newGame(first, second)
+        status = self.post(first, game_id, {'action': 'get_status'}).get_json()
+        version = status['version']
+        player, client = (1, first) if status['next_action'] == 'add_cell' else (2, second)
+        response = self.post(client, game_id, {'action': 'add_cell', 'cell_x': 2, 'cell_y': 3}).get_json()
+        assert response['version'] == version + 1
+        
+        update = self.post(client, game_id, {'action': 'get_status', 'version': version}).get_json()
+        assert update['version'] == version + 1
+        assert update['changes'] == [[2, 3, player]] and 'frame' not in update
+        update = self.post(client, game_id, {'action': 'get_status', 'version': version, 'frames': True}).get_json()
+        assert update['frames'] == [[version + 1, [[2, 3, player]]]]
+        update = self.post(client, game_id, {'action': 'get_status', 'version': version + 1}).get_json()
+        assert 'changes' not in update and 'frame' not in update
+        
+        for old_version in (None, version - 100):
+            update = self.post(client, game_id, {'action': 'get_status', 'version': old_version}).get_json()
+            assert 'changes' not in update
+            frame = update['frame']
+            grid = decodeRLE(frame['rle'], frame['width'])
+            assert len(grid) == frame['height']
+            assert grid[3][2] == player and sum(map(sum, grid)) == player
+
+    """ Game's page and status wait for changes made under game's lock (mid-round, grid lags behind version) """
+    def test_StatusLocked(self):
+        first, second = self.login('p1-'), self.login('p2-')
+        game_id = self.newGame(first, second)
+        with app.app_context():
+            cached = getCachedGame(game_id)
+        responses = {}
+        requests = {
+            'status': lambda: self.post(first, game_id, {'action': 'get_status'}).get_json(),
+            'page': lambda: first.get('/game/{}'.format(game_id)).get_data(as_text=True),
+        }
+        threads = [threading.Thread(target=lambda name=name: responses.update({name: requests[name]()})) for name in requests]
+        with cached.lock:
+            for thread in threads:
+                thread.start()
+            time.sleep(0.3)
+            assert responses == {}
+            assert cached.game.AddCell(0, 0, self.turn(cached)) == True
+        for thread in threads:
+            thread.join()
+        page = responses['page']
+        assert responses['status']['version'] == cached.game.Version
+        assert 'data-version="{}"'.format(cached.game.Version) in page
+    
+    """ Status that didn't change since client's copy (same version and player) is answered with 304 """
+    def test_StatusETag(self):
+        first, second = self.login('p1-'), self.login('p2-')
+        game_id = self.newGame(first, second)
+        status = self.post(first, game_id, {'action': 'get_status'}).get_json()
+        client = first if status['next_action'] == 'add_cell' else second
+        response = self.post(client, game_id, {'action': 'get_status', 'version': status['version']})
+        etag = response.headers['ETag']
+        assert response.status_code == 200
+        response = self.post(client, game_id, {'action': 'get_status', 'version': status['version']}, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.data == b''
+        assert response.headers['ETag'] == etag
+        
+        self.post(client, game_id, {'action': 'add_cell', 'cell_x': 0, 'cell_y': 0})
+        response = self.post(client, game_id, {'action': 'get_status', 'version': status['version']}, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert response.get_json()['version'] == status['version'] + 1
+
+
+
+
+class StoreTestCase(AppTestCase):
+    def setUp(self):
+        self.first, self.second = self.login('p1-'), self.login('p2-')
+        self.game_id = self.newGame(self.first, self.second)
+
+    """ Write from stale copy must not overwrite newer one: it raises and copy is dropped """
+    def test_StaleWrite(self):
+        with app.app_context():
+            stale = self.__loadCopy()
+            fresh = getCachedGame(self.game_id)
+            player = self.turn(fresh)
+            assert fresh.game.AddCell(0, 0, player) == True
+            saveGameState(fresh)
+            assert stale.game.AddCell(1, 1, player) == True
+            with self.assertRaises(GameConflictError):
+                saveGameState(stale)
+            assert game_cache.Get(self.game_id) is None
+            
+            stored = getCachedGame(self.game_id)
+            assert stored.game.Grid[0][0] == player and stored.game.Grid[1][1] == 0
+            assert db.session.get(Game, self.game_id).version == stored.game.Version == fresh.game.Version
+
+    """ Cell added to stale copy is checked against and applied to latest state """
+    def test_ChangeGame(self):
+        with app.app_context():
+            stale = self.__loadCopy()
+            fresh = getCachedGame(self.game_id)
+            player = self.turn(fresh)
+            assert fresh.game.AddCell(0, 0, player) == True
+            saveGameState(fresh)
+            version = fresh.game.Version
+            cached, added, _ = changeGame(stale, lambda game: game.AddCell(0, 0, player))
+            assert added == False and cached.game.error_message
+            assert db.session.get(Game, self.game_id).version == version
+            
+            cached, added, version = changeGame(stale, lambda game: game.AddCell(3, 3, player))
+            assert added == True and cached is not stale
+            assert version == fresh.game.Version + 1
+            game_cache.Invalidate(self.game_id)
+            stored = getCachedGame(self.game_id)
+            assert stored.game.Grid[0][0] == player and stored.game.Grid[3][3] == player
+            assert stored.game.Version == version == db.session.get(Game, self.game_id).version
+            assert GameEvent.query.filter_by(game_id=self.game_id, version=version).count() == 1
+
+    """ Game with gap in its events is neither cached nor served, so nothing is written on top of it """
+    def test_EventLogGap(self):
+        with app.app_context():
+            cached = getCachedGame(self.game_id)
+            player = self.turn(cached)
+            for x in range(3):
+                assert cached.game.AddCell(x, 0, player) == True
+            saveGameState(cached)
+            version = cached.game.Version
+            GameEvent.query.filter_by(game_id=self.game_id, version=version - 1).delete()
+            db.session.commit()
+            game_cache.Invalidate(self.game_id)
+            with self.assertRaises(GameRecoveryError):
+                getCachedGame(self.game_id)
+            assert game_cache.Get(self.game_id) is None
+        
+        response = self.post(self.first, self.game_id, {'action': 'add_cell', 'cell_x': 5, 'cell_y': 5}).get_json()
+        assert response['error'] == True
+        assert self.first.get('/game/{}'.format(self.game_id)).status_code == 302
+        with app.app_context():
+            assert game_cache.Get(self.game_id) is None
+            assert db.session.get(Game, self.game_id).version == version
+            assert GameEvent.query.filter_by(game_id=self.game_id).count() == 2
+    
+    """ Game whose write failed is dropped from cache, so cell added after it is logged right after stored events """
+    def test_FailedWrite(self):
+        with app.app_context():
+            cached = getCachedGame(self.game_id)
+            version = cached.game.Version
+            client = self.first if self.turn(cached) == 1 else self.second
+        locked = OperationalError('COMMIT', {}, Exception('database is locked'))
+        with unittest.mock.patch.object(db.session, 'commit', side_effect=locked):
+            response = self.post(client, self.game_id, {'action': 'add_cell', 'cell_x': 0, 'cell_y': 0})
+        assert response.status_code == 500
+        assert game_cache.Get(self.game_id) is None
+        
+        response = self.post(client, self.game_id, {'action': 'add_cell', 'cell_x': 1, 'cell_y': 1}).get_json()
+        assert response['version'] == version + 1
+        with app.app_context():
+            assert [event.version for event in GameEvent.query.filter_by(game_id=self.game_id)] == [version + 1]
+            game_cache.Invalidate(self.game_id)
+            stored = getCachedGame(self.game_id)
+            assert stored.game.Version == version + 1
+            assert stored.game.Grid[0][0] == 0 and stored.game.Grid[1][1] != 0
+    
+    """ Copy of game as if it was loaded by other process, not shared through cache """
+    def __loadCopy(self):
+        game_cache.Invalidate(self.game_id)
+        cached = getCachedGame(self.game_id)
+        game_cache.Invalidate(self.game_id)
+        return cached
+
+
+
+class SchedulerTestCase(AppTestCase):
+    """ Duplicate submit does nothing, round is moved and job is done once game waits for players again """
+    def test_Submit(self):
+        scheduler = GenerationScheduler(app, workers=1, interval=0.01)
+        game_id = self.__newRound()
+        with app.app_context():
+            cached = getCachedGame(game_id)
+            """ Game is held, so its first tick can't end before second submit """
+            with cached.lock:
+                assert scheduler.Submit(game_id) == True
+                assert scheduler.Submit(game_id) == False
+            assert self.__waitForJob(game_id) == GenerationJob.DONE
+            assert cached.game.Phase != 1
+            assert db.session.get(Game, game_id).version == cached.game.Version
+            assert db.session.query(GenerationJob.lease_owner).filter_by(game_id=game_id).scalar() is None
+            assert scheduler.IsActive(game_id) == False
+
+    """ Job is stored along with game's generations-step phase, so it's resumed on start even if it was never submitted """
+    def test_Resume(self):
+        game_id = self.__newRound()
+        with app.app_context():
+            job = GenerationJob.query.filter_by(game_id=game_id).first()
+            assert job.status == GenerationJob.PENDING
+            job.status = GenerationJob.RUNNING
+            db.session.commit()
+            GenerationScheduler(app, workers=1, interval=0.01).Start()
+            assert self.__waitForJob(game_id) == GenerationJob.DONE
+            assert getCachedGame(game_id).game.Phase != 1
+
+    """ First submits racing each other both insert game's job, later one finds it's there and sets it pending """
+    def test_SubmitRace(self):
+        game_id = self.newGame(self.login('p1-'))
+        update = Query.update
+        updates = []
+        """ Submit's update misses job as if it wasn't inserted yet (scheduler threads' updates are let through) """
+        thread = threading.get_ident()
+        def missOnce(query, values, *args, **kwargs):
+            if threading.get_ident() == thread:
+                updates.append(values)
+                if len(updates) == 1:
+                    return 0
+            return update(query, values, *args, **kwargs)
+        with app.app_context():
+            assert GenerationScheduler(app, workers=1).Submit(game_id) == True
+            with unittest.mock.patch.object(Query, 'update', missOnce):
+                assert GenerationScheduler(app, workers=1).Submit(game_id) == True
+            assert len(updates) == 2
+            assert GenerationJob.query.filter_by(game_id=game_id).count() == 1
+    
+    """ Failed move is retried on game reloaded from DB (cached one may be ahead of it) """
+    def test_Retry(self):
+        saves = []
+        def failOnce(cached):
+            saves.append(cached)
+            if len(saves) == 1:
+                raise RuntimeError('Lost connection')
+            saveGameState(cached)
+        scheduler = GenerationScheduler(app, workers=1, interval=0.01, retry_interval=0.05)
+        game_id = self.__newRound()
+        with app.app_context(), unittest.mock.patch('game.scheduler.saveGameState', failOnce):
+            scheduler.Submit(game_id)
+            assert self.__waitForJob(game_id) == GenerationJob.DONE
+        assert len(saves) == 2
+        assert saves[0] is not saves[1]
+        assert saves[0].game.Version == saves[1].game.Version
+        with app.app_context():
+            assert db.session.get(Game, game_id).version == saves[1].game.Version
+
+    """ New game with all of its first round's cells added """
+    def __newRound(self) -> int:
+        game_id = self.newGame(self.login('p1-'), self.login('p2-'))
+        with app.app_context():
+            cached = getCachedGame(game_id)
+            rows = {1: iter(range(5, 10)), 2: iter(range(5, 10))}
+            while cached.game.Phase == 0:
+                player = self.turn(cached)
+                assert cached.game.AddCell(player * 10 - 5, next(rows[player]), player) == True
+            saveGameState(cached)
+        return game_id
+
+    """ Job's status once it's done (or when timeout passes) """
+    def __waitForJob(self, game_id, timeout: float=10) -> int:
+        deadline = time.monotonic() + timeout
+        while True:
+            db.session.rollback()
+            status = db.session.query(GenerationJob.status).filter_by(game_id=game_id).scalar()
+            if status == GenerationJob.DONE or time.monotonic() > deadline:
+                return status
+            time.sleep(0.01)
+
+    """ Only one scheduler holds game's lease until it expires or job is done """
+    def test_Lease(self):
+        game_id = self.newGame(self.login('p1-'))
+        with app.app_context():
+            """ Done job isn't resumed by app's own scheduler """
+            db.session.add(GenerationJob(game_id=game_id, status=GenerationJob.DONE))
+            db.session.commit()
+            first, second = GenerationScheduler(app, lease_ttl=60), GenerationScheduler(app, lease_ttl=60)
+            take = lambda scheduler: scheduler._GenerationScheduler__takeLease(game_id)
+            assert take(first) == True
+            assert take(second) == False
+            assert take(first) == True
+            
+            GenerationJob.query.filter_by(game_id=game_id).update({'lease_until': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+            assert take(second) == True
+            assert take(first) == False
+            second._GenerationScheduler__setJobStatus(game_id, GenerationJob.DONE)
+            assert GenerationJob.query.filter_by(game_id=game_id).first().lease_owner is None
+            assert take(first) == True
+
+
+
+class BenchTestCase(unittest.TestCase):
+    def test_Run(self):
+        results = runBenchmarks(sizes=[(30, 20)], players_numbers=[1, 5], densities=[0.3], repeat=1)
+        assert len(results) == 2 * 6
+        assert all(seconds > 0 for seconds in results.values())
+        assert 'storage/30x20/p5/d0.3' in results
+    
+    def test_Compare(self):
+        baseline = {'move/a': 1.0, 'move/b': 1.0, 'move/c': 1.0}
+        results = {'move/a': 1.1, 'move/b': 1.5, 'move/d': 9.0}
+        assert compareResults(results, baseline, 0.2) == {'move/b': (1.0, 1.5)}
+        assert compareResults(results, baseline, 0.6) == {}
+
+
+
+class LoadStatsTestCase(unittest.TestCase):
+    def test_Percentile(self):
+        values = list(range(100, 0, -1))
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile([7], 0.99) == 7
+        assert percentile([], 0.5) == 0.0
+    
+    def test_Report(self):
+        class Response:
+            def __init__(self, status_code):
+                self.status_code = status_code
+        
+        stats = LoadStats()
+        stats.Measure('get_status', lambda: (stats.OnCommit(None), Response(200))[1])
+        stats.Measure('get_status', lambda: Response(500))
+        assert stats.Measure('add_cell', lambda: 1 / 0) is None
+        stats.OnCommit(None)
+        report = stats.Report(2.0)
+        assert report['get_status']['requests'] == 2
+        assert report['get_status']['errors'] == 1
+        assert report['get_status']['per_second'] == 1.0
+        assert report['get_status']['commits_per_request'] == 0.5
+        assert report['add_cell']['errors'] == 1
+        assert report['background']['commits'] == 1
+
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_Histogram(self):
+        histogram = Histogram()
+        for seconds in (0.0005, 0.003, 0.003, 0.2, 100.0):
+            histogram.Observe(seconds)
+        data = histogram.ToDict()
+        assert data['count'] == 5
+        assert data['buckets']['0.001'] == 1
+        assert data['buckets']['0.005'] == 3
+        assert data['buckets']['+Inf'] == 5
+        assert data['p50'] == 0.005
+        assert data['p99'] == 100.0
+    
+    """ Nested phase's time only counts for nested phase """
+    def test_Phases(self):
+        metrics = Metrics()
+        with app.app_context():
+            metrics.Start('request')
+            metrics.SetAction('game.get_status')
+            with metrics.Phase('deserialize'):
+                with metrics.Phase('db'):
+                    time.sleep(0.02)
+            """ Phase that isn't current one can't be exited """
+            metrics.ExitPhase('render')
+            metrics.Finish()
+            metrics.Finish()
+        with metrics.Phase('outside'):
+            pass
+        timings = metrics.ToDict()
+        assert set(timings) == {'game.get_status', 'game.get_status.db', 'game.get_status.deserialize', 'game.get_status.other'}
+        assert timings['game.get_status']['count'] == 1
+        assert timings['game.get_status.db']['sum'] >= 0.02
+        assert timings['game.get_status.deserialize']['sum'] < 0.01
+    
+    def test_Profiler(self):
+        profiler = SamplingProfiler()
+        stop = threading.Event()
+        def work(game_id):
+            profiler.Enter(game_id)
+            while not stop.is_set():
+                sum(range(1000))
+            profiler.Exit()
+        threads = [threading.Thread(target=work, args=(game_id,)) for game_id in (1, 2)]
+        for thread in threads:
+            thread.start()
+        try:
+            report = profiler.Sample(1, 0.2, interval=0.002)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        assert report['samples'] > 0
+        assert sum(path['samples'] for path in report['hot_paths']) == report['samples']
+        """ Function sampled at several of its lines is still one function """
+        work_functions = [function for function in report['functions'] if function['function'].endswith(' work')]
+        assert len(work_functions) == 1
+        assert work_functions[0]['total'] == report['samples']
+        assert work_functions[0]['function'].endswith(':{} work'.format(work.__code__.co_firstlineno))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
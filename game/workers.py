@@ -0,0 +1,305 @@
+""" Simulation worker processes module """
+import concurrent.futures
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from game.game import GameOfLife, GameState, getGame
+from game.grid import PackedGrid
+
+
+""" Worker process exited (or got stuck) before answering request """
+class WorkerError(RuntimeError):
+    pass
+
+
+"""
+    Pool of simulation processes
+    Game always goes to the same worker (game id modulo workers number),
+    which keeps game warm between generations, so state is only sent
+    when game was changed elsewhere (e.g. cells were added)
+    Grids are handed over through shared memory, packed (see PackedGrid),
+    one segment per game; everything else goes through queues
+    Worker that exits is replaced on its next request; request that takes
+    longer than timeout kills its worker, either way WorkerError is raised
+"""
+class SimulationPool:
+    __slots__ = ('__processes_number', '__timeout', '__context', '__workers', '__segments',
+                 '__worker_versions', '__lock', '__request_ids')
+
+    def __init__(self, processes: int, timeout: float=60.0):
+        self.__processes_number = processes
+        self.__timeout = timeout
+        self.__context = multiprocessing.get_context('spawn')
+        self.__workers = []
+        """ game id => shared memory segment with game's packed grid """
+        self.__segments = {}
+        """ game id => version of game's state worker has """
+        self.__worker_versions = {}
+        self.__lock = threading.Lock()
+        self.__request_ids = itertools.count()
+
+    def Start(self):
+        with self.__lock:
+            if self.__workers:
+                return
+            for _ in range(self.__processes_number):
+                self.__workers.append(_Worker(self.__context))
+
+    def Stop(self):
+        with self.__lock:
+            for worker in self.__workers:
+                worker.Stop()
+            self.__workers = []
+            for segment in self.__segments.values():
+                segment.close()
+                segment.unlink()
+            self.__segments = {}
+            self.__worker_versions = {}
+
+    """ Calculate game's next generations in worker, return game's new state and events (see GameOfLife.PopEvents) """
+    def Move(self, game_id: int, game: GameOfLife, generations: int=1) -> tuple:
+        state, events, _ = self.__request(game_id, game, {'generations': generations})
+        return state, events
+
+    """ Calculate rest of game's round in worker, return game's new state, events and frames (see GameOfLife.SimulateRound) """
+    def SimulateRound(self, game_id: int, game: GameOfLife) -> tuple:
+        return self.__request(game_id, game, {'round': True})
+
+    """ Game doesn't need simulation for now (e.g. it's over or waits for players), its segment is freed """
+    def Release(self, game_id: int):
+        with self.__lock:
+            segment = self.__segments.pop(game_id, None)
+            version = self.__worker_versions.pop(game_id, None)
+            if self.__workers and (segment is not None or version is not None):
+                self.__workers[game_id % len(self.__workers)].Request(next(self.__request_ids), {'game_id': game_id, 'release': True})
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+
+    """ Per-worker metrics: process id, whether it's alive, requests in queue, requests done, last and average latency (seconds) """
+    def Stats(self) -> list:
+        return [worker.Stats() for worker in self.__workers]
+
+
+    """ Game's worker, worker that exited is replaced (its games are resent whole) """
+    def __getWorker(self, game_id):
+        with self.__lock:
+            index = game_id % len(self.__workers)
+            if not self.__workers[index].IsAlive:
+                self.__workers[index] = _Worker(self.__context)
+                for worker_game_id in [worker_game_id for worker_game_id in self.__worker_versions
+                                       if worker_game_id % len(self.__workers) == index]:
+                    del self.__worker_versions[worker_game_id]
+            return self.__workers[index]
+
+    def __getSegment(self, game_id, grid):
+        size = len(PackedGrid(len(grid[0]), len(grid)).Buffer())
+        with self.__lock:
+            segment = self.__segments.get(game_id)
+            if segment is None or segment.size < size:
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+                segment = shared_memory.SharedMemory(create=True, size=size)
+                self.__segments[game_id] = segment
+                self.__worker_versions.pop(game_id, None)
+            return segment
+
+    """ Send game to its worker (whole, if worker's copy is outdated), return new state, events and request's result """
+    def __request(self, game_id, game, params):
+        self.Start()
+        worker = self.__getWorker(game_id)
+        state = game._GameOfLife__state
+        segment = self.__getSegment(game_id, state.grid)
+
+        height, width = len(state.grid), len(state.grid[0])
+        request = {
+            'game_id': game_id,
+            'segment': segment.name,
+            'width': width,
+            'height': height,
+            'version': state.version,
+        }
+        request.update(params)
+        if self.__worker_versions.get(game_id) != state.version:
+            """ Worker has no (or outdated) game, send it whole """
+            packed_grid = PackedGrid.FromRows(state.grid)
+            segment.buf[:len(packed_grid.Buffer())] = packed_grid.Buffer()
+            request['settings'] = game._GameOfLife__settings.ToDict()
+            request['state'] = self.__getStateParams(state)
+
+        try:
+            state_params, events, result = worker.Request(next(self.__request_ids), request).result(timeout=self.__timeout)
+        except concurrent.futures.TimeoutError:
+            self.__worker_versions.pop(game_id, None)
+            """ Stuck worker would hold up all its games, it's replaced on next request """
+            worker.Kill()
+            raise WorkerError('Game {} was not simulated in {}s'.format(game_id, self.__timeout))
+        except Exception:
+            self.__worker_versions.pop(game_id, None)
+            raise
+
+        packed_size = len(PackedGrid(width, height).Buffer())
+        state_params['grid'] = PackedGrid(width, height, segment.buf[:packed_size]).ToRows()
+        new_state = GameState.FromStorage(state_params)
+        self.__worker_versions[game_id] = new_state.version
+        return new_state, events, result
+
+    @staticmethod
+    def __getStateParams(state):
+        state_params = state.ToDict()
+        del state_params['grid']
+        return state_params
+
+
+"""
+    One worker process with its queues and stats
+    Once process exits, its requests in progress and any new ones fail with WorkerError
+"""
+class _Worker:
+    __slots__ = ('__process', '__requests', '__responses', '__futures', '__lock', '__alive',
+                 '__reader', '__watcher', '__done', '__latency_total', '__latency_last')
+
+    def __init__(self, context):
+        self.__requests = context.Queue()
+        self.__responses = context.Queue()
+        self.__process = context.Process(target=_workerMain, args=(self.__requests, self.__responses), daemon=True)
+        self.__process.start()
+        """ request id => (future, time request was sent) """
+        self.__futures = {}
+        self.__lock = threading.Lock()
+        self.__alive = True
+        self.__done = 0
+        self.__latency_total = 0.0
+        self.__latency_last = 0.0
+        self.__reader = threading.Thread(target=self.__readResponses, daemon=True)
+        self.__reader.start()
+        self.__watcher = threading.Thread(target=self.__watch, daemon=True)
+        self.__watcher.start()
+
+    def Request(self, request_id, request) -> Future:
+        future = Future()
+        with self.__lock:
+            if not self.__alive:
+                future.set_exception(WorkerError('Worker process {} exited'.format(self.__process.pid)))
+                return future
+            self.__futures[request_id] = (future, time.monotonic())
+        self.__requests.put((request_id, request))
+        return future
+
+    def Stop(self):
+        self.__requests.put(None)
+        self.__process.join(timeout=5)
+
+    def Kill(self):
+        with self.__lock:
+            self.__alive = False
+        self.__process.kill()
+
+    @property
+    def IsAlive(self) -> bool:
+        with self.__lock:
+            return self.__alive and self.__process.is_alive()
+
+    def Stats(self) -> dict:
+        with self.__lock:
+            return {
+                'pid': self.__process.pid,
+                'alive': self.__alive,
+                'queue_depth': len(self.__futures),
+                'requests': self.__done,
+                'last_latency': self.__latency_last,
+                'avg_latency': self.__latency_total / self.__done if self.__done else 0.0,
+            }
+
+    def __readResponses(self):
+        while True:
+            try:
+                request_id, error, result = self.__responses.get(timeout=1.0)
+            except queue.Empty:
+                if self.IsAlive:
+                    continue
+                return
+            except (EOFError, OSError):
+                return
+            with self.__lock:
+                if request_id not in self.__futures:
+                    continue
+                future, sent_at = self.__futures.pop(request_id)
+                self.__latency_last = time.monotonic() - sent_at
+                self.__latency_total += self.__latency_last
+                self.__done += 1
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    """ Wait for process to exit (join waits on its sentinel), then fail its requests in progress (nobody would answer them) """
+    def __watch(self):
+        self.__process.join()
+        with self.__lock:
+            self.__alive = False
+            futures = [future for future, _ in self.__futures.values()]
+            self.__futures.clear()
+        for future in futures:
+            future.set_exception(WorkerError('Worker process {} exited with code {}'.format(self.__process.pid, self.__process.exitcode)))
+
+
+""" Worker process: keeps games warm, moves them on request """
+def _workerMain(requests, responses):
+    games = {}
+    segments = {}
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        request_id, request = message
+        game_id = request['game_id']
+        try:
+            if request.get('release'):
+                games.pop(game_id, None)
+                segment = segments.pop(game_id, None)
+                if segment is not None:
+                    segment.close()
+                responses.put((request_id, None, None))
+                continue
+
+            segment = segments.get(game_id)
+            if segment is None or segment.name != request['segment']:
+                if segment is not None:
+                    segment.close()
+                """ Worker shares pool's resource tracker, segment is unlinked by pool """
+                segment = shared_memory.SharedMemory(name=request['segment'])
+                segments[game_id] = segment
+
+            width, height = request['width'], request['height']
+            packed_size = len(PackedGrid(width, height).Buffer())
+            if 'state' in request:
+                state_params = dict(request['state'])
+                state_params['grid'] = PackedGrid(width, height, segment.buf[:packed_size]).ToRows()
+                games[game_id] = getGame(request['settings'], state_params)
+            game = games.get(game_id)
+            if game is None or game.Version != request['version']:
+                raise RuntimeError('Game {} is out of sync'.format(game_id))
+
+            result = None
+            if request.get('round'):
+                result = game.SimulateRound()
+            elif request['generations'] > 1:
+                game.Advance(request['generations'])
+            else:
+                game.Move()
+
+            state = game._GameOfLife__state
+            packed_grid = PackedGrid.FromRows(state.grid)
+            segment.buf[:len(packed_grid.Buffer())] = packed_grid.Buffer()
+            state_params = state.ToDict()
+            del state_params['grid']
+            responses.put((request_id, None, (state_params, game.PopEvents(), result)))
+        except Exception as e:
+            games.pop(game_id, None)
+            responses.put((request_id, repr(e), None))
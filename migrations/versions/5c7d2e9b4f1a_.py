@@ -0,0 +1,78 @@
+"""game state table
+
+Revision ID: 5c7d2e9b4f1a
+Revises: 3b9e2f6a1c4d
+Create Date: 2026-10-18 14:02:17.804113
+
+"""
+import base64
+import json
+from alembic import op
+import sqlalchemy as sa
+from game.grid import PackedGrid
+
+
+# revision identifiers, used by Alembic.
+revision = '5c7d2e9b4f1a'
+down_revision = '3b9e2f6a1c4d'
+branch_labels = None
+depends_on = None
+
+
+game = sa.table('game',
+    sa.column('id', sa.Integer()),
+    sa.column('state', sa.String(length=1000)),
+)
+game_state = sa.table('game_state',
+    sa.column('game_id', sa.Integer()),
+    sa.column('schema_version', sa.Integer()),
+    sa.column('grid', sa.LargeBinary()),
+    sa.column('params', sa.Text()),
+    sa.column('date_updated', sa.DateTime()),
+)
+
+
+def upgrade():
+    op.create_table('game_state',
+    sa.Column('game_id', sa.Integer(), nullable=False),
+    sa.Column('schema_version', sa.Integer(), nullable=False),
+    sa.Column('grid', sa.LargeBinary(), nullable=False),
+    sa.Column('params', sa.Text(), nullable=False),
+    sa.Column('date_updated', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['game_id'], ['game.id'], ),
+    sa.PrimaryKeyConstraint('game_id')
+    )
+
+    # move states of existing games, grids are stored either packed (base64) or as rows
+    connection = op.get_bind()
+    entries = []
+    for game_id, state in connection.execute(sa.select(game.c.id, game.c.state)):
+        if not state:
+            continue
+        params = json.loads(state)
+        grid = params.pop('grid', [])
+        if isinstance(grid, str):
+            grid = base64.b64decode(grid)
+        else:
+            grid = PackedGrid.FromRows(grid).ToBytes()
+        entries.append({'game_id': game_id, 'schema_version': 1, 'grid': grid,
+                        'params': json.dumps(params), 'date_updated': sa.func.now()})
+    for entry in entries:
+        connection.execute(game_state.insert().values(**entry))
+
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.drop_column('state')
+
+
+def downgrade():
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.add_column(sa.Column('state', sa.String(length=1000), nullable=True))
+
+    connection = op.get_bind()
+    states = connection.execute(sa.select(game_state.c.game_id, game_state.c.grid, game_state.c.params)).fetchall()
+    for game_id, grid, params in states:
+        params = json.loads(params)
+        params['grid'] = base64.b64encode(grid).decode('ascii')
+        connection.execute(game.update().where(game.c.id == game_id).values(state=json.dumps(params)))
+
+    op.drop_table('game_state')